@@ -0,0 +1,109 @@
+"""
+Разбор дат постов ВКонтакте: сверка parse_vk_date с таблицей примеров и замер скорости
+в сравнении с прежним разбором через datetime.strptime.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_dates.py --repeat 100000
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import load_bot
+
+bot = load_bot()
+
+NOW = datetime(2024, 1, 15, 14, 0)
+
+# Строка даты в том виде, в каком её показывает ВКонтакте -> ожидаемый результат при NOW
+CORPUS = [
+    ('только что', NOW),
+    ('минуту назад', NOW - timedelta(minutes=1)),
+    ('2 минуты назад', NOW - timedelta(minutes=2)),
+    ('две минуты назад', NOW - timedelta(minutes=2)),
+    ('15 минут назад', NOW - timedelta(minutes=15)),
+    ('37 секунд назад', NOW - timedelta(seconds=37)),
+    ('час назад', NOW - timedelta(hours=1)),
+    ('три часа назад', NOW - timedelta(hours=3)),
+    ('сегодня в 12:30', datetime(2024, 1, 15, 12, 30)),
+    ('Сегодня в 9:05', datetime(2024, 1, 15, 9, 5)),
+    ('вчера в 23:59', datetime(2024, 1, 14, 23, 59)),
+    ('вчера\xa0в\xa00:01', datetime(2024, 1, 14, 0, 1)),
+    ('12 янв в 10:15', datetime(2024, 1, 12, 10, 15)),
+    ('3 января в 8:00', datetime(2024, 1, 3, 8, 0)),
+    ('28 дек в 18:40', datetime(2023, 12, 28, 18, 40)),
+    ('1 мая в 7:07', datetime(2023, 5, 1, 7, 7)),
+    ('14 сен. в 11:11', datetime(2023, 9, 14, 11, 11)),
+    ('5 мар 2022', datetime(2022, 3, 5)),
+    ('31 августа 2021', datetime(2021, 8, 31)),
+    ('9 ноя 2020 в 16:45', datetime(2020, 11, 9, 16, 45)),
+    ('30 фев 2023', None),
+    ('сегодня в 25:00', None),
+    ('вчера в 12:60', None),
+    ('вчера', None),
+    ('', None),
+    ('Закреплённая запись', None),
+]
+
+def legacy_parse(post_time, current_time):
+    """Прежний разбор из is_recent_post: strptime с "%d %b", зависящим от локали процесса."""
+    if 'сегодня' in post_time.lower():
+        post_time = post_time.lower().replace('сегодня в ', '')
+        return datetime.strptime(post_time, "%H:%M").replace(
+            year=current_time.year, month=current_time.month, day=current_time.day)
+    if 'вчера' in post_time.lower():
+        post_time = post_time.lower().replace('вчера в ', '')
+        return datetime.strptime(post_time, "%H:%M").replace(
+            year=current_time.year, month=current_time.month, day=current_time.day) - timedelta(days=1)
+    return datetime.strptime(post_time, "%d %b в %H:%M").replace(year=current_time.year)
+
+def check_corpus():
+    failures = 0
+    for text, expected in CORPUS:
+        result = bot.parse_vk_date(text, now=NOW)
+        if result != expected:
+            failures += 1
+            print(f"ОШИБКА: {text!r}: ожидалось {expected}, получено {result}")
+    print(f"Таблица примеров: {len(CORPUS) - failures} из {len(CORPUS)} верно")
+    return failures
+
+def bench(parse, texts, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            try:
+                parse(text)
+            except ValueError:
+                pass
+    return (time.perf_counter() - started) / (repeat * len(texts))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20000, help='повторов разбора каждой строки')
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    texts = [text for text, _ in CORPUS]
+    legacy_failures = 0
+    for text in texts:
+        try:
+            legacy_parse(text, NOW)
+        except ValueError:
+            legacy_failures += 1
+    print(f"Прежний разбор не справился с {legacy_failures} из {len(texts)} строк")
+
+    # Типичная стена: несколько относительных дат и даты с русскими месяцами
+    wall = ['сегодня в 12:30', 'вчера в 23:59', '12 янв в 10:15', '28 дек в 18:40', '5 мар 2022']
+    legacy_time = bench(lambda text: legacy_parse(text, NOW), wall, args.repeat)
+    bot._parse_vk_date_spec.cache_clear()
+    new_time = bench(lambda text: bot.parse_vk_date(text, now=NOW), wall, args.repeat)
+    cold_time = bench(lambda text: bot._parse_vk_date_spec.__wrapped__(text), wall, args.repeat)
+    print(f"strptime (прежний, с исключениями): {legacy_time * 1e6:.2f} мкс на строку")
+    print(f"parse_vk_date (с кэшем):           {new_time * 1e6:.2f} мкс на строку")
+    print(f"разбор строки без кэша:            {cold_time * 1e6:.2f} мкс на строку")
+    print(f"Кэш разбора: {bot._parse_vk_date_spec.cache_info()}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Сравнение двух способов разбора стены ВКонтакте на сохранённых HTML-страницах из benchmarks/fixtures:
+HTTP-загрузчик (разбор selectolax) и Playwright (Chromium, один вызов page.evaluate на стену).
+Настоящие стены (wall_*.html) записываются скриптом record_walls.py; synthetic_*.html собраны вручную
+по разметке ВК и проверяют только селекторы, на скорость разбора реальных стен по ним судить нельзя.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_parsers.py --repeat 200
+    python benchmarks/bench_parsers.py --no-browser   # только разбор без браузера
+"""
+import argparse
+import asyncio
+import glob
+import os
+import resource
+import time
+import tracemalloc
+
+from common import load_bot
+
+bot = load_bot()
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixtures():
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+def bench_http(html, repeat):
+    tracemalloc.start()
+    _, posts = bot.parse_wall_html(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        bot.parse_wall_html(html)
+    elapsed = (time.perf_counter() - started) / repeat
+    return posts, elapsed, peak
+
+async def bench_playwright(fixtures, repeat):
+    results = {}
+    async with bot.async_playwright() as p:
+        browser = await p.chromium.launch()
+        page = await browser.new_page()
+        for name, html in fixtures.items():
+            await page.set_content(html)
+            _, posts = await bot.extract_wall_posts(page)
+            started = time.perf_counter()
+            for _ in range(repeat):
+                await bot.extract_wall_posts(page)
+            results[name] = (posts, (time.perf_counter() - started) / repeat)
+        await browser.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200, help='повторов разбора на одну стену')
+    parser.add_argument('--no-browser', action='store_true', help='не запускать Chromium')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    if not any(name.startswith('wall_') for name in fixtures):
+        print("ВНИМАНИЕ: записанных стен нет, только синтетические (python benchmarks/record_walls.py <группы>)")
+    http_results = {name: bench_http(html, args.repeat) for name, html in fixtures.items()}
+    browser_results = {}
+    if not args.no_browser:
+        # Браузерный разбор на порядки медленнее, повторов меньше
+        browser_results = asyncio.run(bench_playwright(fixtures, max(1, args.repeat // 20)))
+
+    print(f"{'стена':<26}{'постов':>8}{'http, мс':>12}{'http, КБ':>10}{'playwright, мс':>16}{'ускорение':>11}")
+    for name, (posts, http_time, peak) in http_results.items():
+        line = f"{name:<26}{len(posts):>8}{http_time * 1000:>12.2f}{peak / 1024:>10.0f}"
+        if name in browser_results:
+            browser_posts, browser_time = browser_results[name]
+            if browser_posts != posts:
+                print(f"ВНИМАНИЕ: результаты разбора {name} различаются")
+            line += f"{browser_time * 1000:>16.2f}{browser_time / http_time:>10.0f}x"
+        if name.startswith('synthetic_'):
+            line += "  (синтетическая)"
+        print(line)
+
+    # ru_maxrss в Linux указывается в килобайтах
+    print(f"Пиковый RSS процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+    if browser_results:
+        print(f"Пиковый RSS крупнейшего процесса Chromium: "
+              f"{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} МБ")
+
+if __name__ == '__main__':
+    main()
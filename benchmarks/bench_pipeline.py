@@ -0,0 +1,329 @@
+"""
+Сквозной замер конвейера бота без сети: локальный поддельный ВКонтакте отдаёт стены групп,
+локальная заглушка Telegram Bot API записывает вызовы. Группы проверяет monitor_vk_groups по расписанию
+PollScheduler, новые посты рассылаются через DELIVERY, как в рабочем режиме; поддельные группы
+публикуют посты в случайные моменты, в среднем раз в --post-interval секунд. Посты, бывшие на стенах
+до начала замера, считаются уже разосланными.
+
+Отчёт раз в --report секунд: проверки групп, опоздание проверок, новые посты, сообщения, глубина очереди
+и задержка от публикации поста до первого получателя; в конце — задержки до первого и последнего
+получателя и пиковый RSS.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_pipeline.py --groups 50 --posts 20 --subscribers 200 --duration 60
+    python benchmarks/bench_pipeline.py --vk-latency 0.3 --vk-failure-rate 0.05 --retry-after-rate 0.01
+    python benchmarks/bench_pipeline.py --fetcher playwright   # нужен установленный Chromium
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import resource
+import time
+from datetime import datetime
+from html import escape
+from urllib.parse import parse_qs, urlsplit
+
+from telegram.ext import Application
+
+from common import load_bot
+
+bot = load_bot(open_storage=True)
+
+WORDS = ("ученики школа конкурс победители поздравляем родители собрание олимпиада "
+         "спорт соревнования библиотека праздник учителя выпускники экскурсия район").split()
+
+async def serve_connection(handler, reader, writer):
+    """Минимальный HTTP/1.1 с keep-alive: тела запросов только с Content-Length."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, content_type, payload = await handler(method, path, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_server(handler):
+    server = await asyncio.start_server(lambda r, w: serve_connection(handler, r, w), '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+class FakeVk:
+    """
+    Поддельный ВКонтакте: стена каждой группы в классической разметке (.post, .wall_post_text,
+    img.attachment__link, дата "сегодня в ЧЧ:ММ"). add_posts() публикует новые посты сверху
+    и запоминает время публикации; текст поста начинается с метки #<ID поста>.
+    """
+
+    def __init__(self, groups, posts, images, latency, failure_rate):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.images = images
+        self.requests = 0
+        self.failures = 0
+        self.published = {}  # ID поста -> время публикации (time.monotonic)
+        self._walls = {group: [] for group in groups}
+        self._next_number = {group: 1 for group in groups}
+        for group in groups:
+            self.add_posts(group, posts)
+
+    def add_posts(self, group, count):
+        owner = -(abs(hash(group)) % 10 ** 9)
+        for _ in range(count):
+            number = self._next_number[group]
+            self._next_number[group] += 1
+            post_id = f"{owner}_{number}"
+            text = f"#{post_id} " + '<br>'.join(
+                escape(' '.join(random.choices(WORDS, k=25)).capitalize()) for _ in range(2))
+            images = ''.join(
+                f'<img class="attachment__link" src="https://sun9-1.userapi.com/{post_id}_{index}.jpg">'
+                for index in range(random.randint(0, self.images))
+            )
+            now = datetime.now()
+            self._walls[group].insert(0, (
+                f'<div class="_post post page_block" data-post-id="{post_id}">'
+                f'<div class="post_header"><span class="rel_date" data-testid="post_date_block_preview">'
+                f'сегодня в {now.hour}:{now.minute:02d}</span></div>'
+                f'<div class="wall_text"><div class="wall_post_text">{text}</div>{images}</div></div>'
+            ))
+            self.published[post_id] = time.monotonic()
+        del self._walls[group][20:]  # ВКонтакте показывает около 20 верхних постов
+
+    async def handle(self, method, path, headers, body):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        group = path.strip('/')
+        if group not in self._walls:
+            return '404 Not Found', 'text/plain', b'not found'
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            return '500 Internal Server Error', 'text/plain', b'error'
+        html = ('<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"></head><body>'
+                f'<div id="page_wall_posts">{"".join(self._walls[group])}</div></body></html>')
+        return '200 OK', 'text/html; charset=utf-8', html.encode('utf-8')
+
+class FakeTelegram:
+    """
+    Заглушка Bot API: отвечает на getMe, sendMessage, sendPhoto и sendMediaGroup, записывает вызовы
+    и с вероятностью retry_after_rate отвечает 429 с retry_after.
+    По метке #<ID поста> в тексте запоминает время первой и последней отправки каждого поста.
+    """
+
+    POST_MARK = re.compile(r'#(-?\d+_\d+)')
+
+    def __init__(self, retry_after_rate, retry_after):
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls = {}
+        self.throttled = 0
+        self.delivered = {}  # ID поста -> [первая отправка, последняя отправка] (time.monotonic)
+        self._message_id = 0
+
+    def _message(self, chat_id, photo=None):
+        self._message_id += 1
+        message = {'message_id': self._message_id, 'date': int(time.time()),
+                   'chat': {'id': int(chat_id), 'type': 'private'}}
+        if photo is not None:
+            file_id = photo if not photo.startswith('http') else f"file-{abs(hash(photo))}"
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600}]
+        return message
+
+    async def handle(self, method, path, headers, body):
+        api_method = path.rsplit('/', 1)[-1]
+        if headers.get('content-type', '').startswith('application/json'):
+            params = json.loads(body or b'{}')
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+        params.update({key: values[0] for key, values in parse_qs(urlsplit(path).query).items()})
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+
+        if api_method != 'getMe' and random.random() < self.retry_after_rate:
+            self.throttled += 1
+            response = {'ok': False, 'error_code': 429,
+                        'description': f'Too Many Requests: retry after {self.retry_after}',
+                        'parameters': {'retry_after': self.retry_after}}
+            return '429 Too Many Requests', 'application/json', json.dumps(response).encode()
+
+        if api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif api_method == 'sendPhoto':
+            result = self._message(params['chat_id'], photo=params['photo'])
+        elif api_method == 'sendMediaGroup':
+            media = json.loads(params['media'])
+            result = [self._message(params['chat_id'], photo=item['media']) for item in media]
+        else:
+            result = self._message(params['chat_id'])
+        mark = self.POST_MARK.search(params.get('text') or params.get('caption') or params.get('media') or '')
+        if mark:
+            now = time.monotonic()
+            self.delivered.setdefault(mark.group(1), [now, now])[1] = now
+        return '200 OK', 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+async def publish_posts(fake_vk, group, interval):
+    """Публикует в группе по одному посту через случайные промежутки, в среднем interval секунд."""
+    while True:
+        await asyncio.sleep(random.expovariate(1 / interval))
+        fake_vk.add_posts(group, 1)
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def counter_total(snapshot, name):
+    return sum(snapshot['counters'].get(name, {}).values())
+
+def delivery_latencies(fake_vk, fake_telegram, post_ids):
+    """Задержки от публикации поста до первого и до последнего получателя, секунды."""
+    first, last = [], []
+    for post_id in post_ids:
+        first.append(fake_telegram.delivered[post_id][0] - fake_vk.published[post_id])
+        last.append(fake_telegram.delivered[post_id][1] - fake_vk.published[post_id])
+    return first, last
+
+async def run(args):
+    random.seed(args.seed)
+    groups = [f"bench_group_{index}" for index in range(args.groups)]
+    fake_vk = FakeVk(groups, args.posts, args.images, args.vk_latency, args.vk_failure_rate)
+    fake_telegram = FakeTelegram(args.retry_after_rate, args.retry_after)
+    vk_server, vk_port = await start_server(fake_vk.handle)
+    telegram_server, telegram_port = await start_server(fake_telegram.handle)
+
+    bot.VK_BASE_URL = f"http://127.0.0.1:{vk_port}"
+    bot.DEFAULT_FETCHER = args.fetcher
+    bot.CRAWL_CONCURRENCY = args.concurrency
+    for chat_id in range(1, args.subscribers + 1):
+        bot.SUBSCRIBERS.add_user(chat_id, groups)
+    # Стены на момент запуска считаются уже разосланными, как у давно работающего бота:
+    # иначе их тысячи сообщений заслонят задержку рассылки новых постов
+    for post_id in fake_vk.published:
+        bot.sent_posts.add(post_id)
+    bot.POLL_MIN_INTERVAL = args.poll_min
+    bot.POLL_MAX_INTERVAL = args.poll_max
+    bot.MONITOR_REPORT_INTERVAL = args.report
+    bot.DELIVERY = bot.DeliveryQueue(args.workers, args.global_rate, args.chat_rate, bot.DELIVERY_MAX_ATTEMPTS)
+    # Показатель глубины очереди был привязан к заменённой очереди
+    bot.METRICS.gauge('vkbot_delivery_queue_depth', bot.DELIVERY.depth)
+
+    application = (Application.builder().token(bot.TELEGRAM_BOT_TOKEN)
+                   .base_url(f"http://127.0.0.1:{telegram_port}/bot").build())
+    await application.initialize()
+    await bot.DELIVERY.start(application.bot)
+    if args.fetcher == 'playwright':
+        await bot.BROWSER.start()
+
+    print(f"Групп {args.groups}, постов на стене {args.posts}, подписчиков {args.subscribers}, "
+          f"загрузчик {args.fetcher}, параллельность {args.concurrency}, "
+          f"интервал проверки {args.poll_min:g}-{args.poll_max:g} с, пост в группе раз в {args.post_interval:g} с")
+    print(f"{'время, с':>8}{'проверок':>10}{'без изм.':>10}{'ошибок':>8}{'опозд., с':>11}{'новых':>7}"
+          f"{'сообщ.':>8}{'сообщ./с':>10}{'очередь':>9}{'до 1-го, с':>12}")
+    monitor = asyncio.create_task(bot.monitor_vk_groups(groups))
+    publishers = [asyncio.create_task(publish_posts(fake_vk, group, args.post_interval)) for group in groups]
+    started = time.monotonic()
+    previous = bot.METRICS.snapshot()
+    sent_before = bot.DELIVERY.stats['sent']
+    interval_started = started
+    reported = set()
+    try:
+        while time.monotonic() - started < args.duration:
+            await asyncio.sleep(min(args.report, args.duration - (time.monotonic() - started)))
+            interval = time.monotonic() - interval_started
+            snapshot = bot.METRICS.snapshot()
+            checks = {status: snapshot['counters'].get('vkbot_group_checks_total', {}).get(f'status={status}', 0)
+                      - previous['counters'].get('vkbot_group_checks_total', {}).get(f'status={status}', 0)
+                      for status in ('changed', 'unchanged', *bot.CRAWL_FAILED)}
+            lag = snapshot['histograms'].get('vkbot_poll_lag_seconds', {}).get('', {'count': 0, 'sum': 0})
+            previous_lag = previous['histograms'].get('vkbot_poll_lag_seconds', {}).get('', {'count': 0, 'sum': 0})
+            lag_count = lag['count'] - previous_lag['count']
+            new_posts = (counter_total(snapshot, 'vkbot_posts_new_total')
+                         - counter_total(previous, 'vkbot_posts_new_total'))
+            sent = bot.DELIVERY.stats['sent'] - sent_before
+            # Задержка до первого получателя — по постам, опубликованным во время замера и впервые
+            # отправленным в этом интервале; до последнего получателя — в итоге, после дорассылки
+            fresh = [post_id for post_id in fake_telegram.delivered
+                     if post_id not in reported and fake_vk.published.get(post_id, 0) >= started]
+            reported.update(fresh)
+            first, _ = delivery_latencies(fake_vk, fake_telegram, fresh)
+            print(f"{time.monotonic() - started:>8.0f}{sum(checks.values()):>10}{checks['unchanged']:>10}"
+                  f"{sum(checks[status] for status in bot.CRAWL_FAILED):>8}"
+                  f"{(lag['sum'] - previous_lag['sum']) / max(lag_count, 1):>11.2f}{new_posts:>7}{sent:>8}"
+                  f"{sent / interval:>10.1f}{snapshot['gauges']['vkbot_delivery_queue_depth']:>9}"
+                  f"{percentile(first, 0.5):>12.2f}")
+            previous = snapshot
+            sent_before = bot.DELIVERY.stats['sent']
+            interval_started += interval
+    finally:
+        for task in publishers:
+            task.cancel()
+        monitor.cancel()
+        await asyncio.gather(monitor, *publishers, return_exceptions=True)
+        await bot.DELIVERY.stop(bot.DELIVERY_STOP_TIMEOUT)
+        await application.shutdown()
+        for fetcher in bot.FETCHERS.values():
+            await fetcher.close()
+        await bot.BROWSER.stop()
+        vk_server.close()
+        telegram_server.close()
+
+    measured = [post_id for post_id, published in fake_vk.published.items()
+                if published >= started and post_id in fake_telegram.delivered]
+    first, last = delivery_latencies(fake_vk, fake_telegram, measured)
+    print(f"Опубликовано за замер {sum(published >= started for published in fake_vk.published.values())}, "
+          f"разослано {len(measured)}; задержка до первого получателя p50 {percentile(first, 0.5):.2f} с, "
+          f"p95 {percentile(first, 0.95):.2f} с; до последнего p50 {percentile(last, 0.5):.2f} с, "
+          f"p95 {percentile(last, 0.95):.2f} с")
+    print(f"Запросов к ВК: {fake_vk.requests} (ошибок {fake_vk.failures}); вызовы Bot API: {fake_telegram.calls}; "
+          f"ответов 429: {fake_telegram.throttled}")
+    print(f"Повторов отправки {bot.DELIVERY.stats['retried']}, ошибок отправки {bot.DELIVERY.stats['failed']}")
+    # ru_maxrss в Linux указывается в килобайтах
+    print(f"Пиковый RSS процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+    if args.fetcher == 'playwright':
+        print(f"Пиковый RSS крупнейшего процесса Chromium: "
+              f"{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} МБ")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, default=50, help='число групп')
+    parser.add_argument('--posts', type=int, default=20, help='постов на стене при старте')
+    parser.add_argument('--post-interval', type=float, default=30, help='средний промежуток между постами группы, секунды')
+    parser.add_argument('--images', type=int, default=3, help='максимум изображений в посте')
+    parser.add_argument('--subscribers', type=int, default=100, help='число подписчиков (подписаны на все группы)')
+    parser.add_argument('--duration', type=float, default=60, help='длительность замера, секунды')
+    parser.add_argument('--report', type=float, default=10, help='как часто печатать отчёт, секунды')
+    parser.add_argument('--poll-min', type=float, default=2, help='минимальный интервал проверки группы, секунды')
+    parser.add_argument('--poll-max', type=float, default=30, help='максимальный интервал проверки группы, секунды')
+    parser.add_argument('--fetcher', choices=sorted(bot.FETCHERS), default='http', help='способ загрузки стен')
+    parser.add_argument('--concurrency', type=int, default=bot.CRAWL_CONCURRENCY, help='групп одновременно')
+    parser.add_argument('--vk-latency', type=float, default=0.05, help='средняя задержка ответа ВК, секунды')
+    parser.add_argument('--vk-failure-rate', type=float, default=0.0, help='доля ответов ВК с ошибкой 500')
+    parser.add_argument('--workers', type=int, default=bot.DELIVERY_WORKERS, help='воркеров рассылки')
+    # По умолчанию лимиты сняты, чтобы мерить сам конвейер; для проверки рабочих лимитов задайте 30 и 1
+    parser.add_argument('--global-rate', type=float, default=10000, help='лимит сообщений в секунду всего')
+    parser.add_argument('--chat-rate', type=float, default=10000, help='лимит сообщений в секунду в один чат')
+    parser.add_argument('--retry-after-rate', type=float, default=0.0, help='доля ответов Bot API с 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, секунды')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
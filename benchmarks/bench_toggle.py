@@ -0,0 +1,69 @@
+"""
+Скорость переключения подписок: прежняя схема (словарь списков и полная перезапись
+subscribers.json на каждое нажатие) против SubscriptionStore с отложенной записью в SQLite.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_toggle.py --users 10000 --toggles 500
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from common import load_bot
+
+bot = load_bot()
+
+def bench_json(users, taps):
+    """Прежняя реализация toggle_subscription: list.remove/append и json.dump всего словаря."""
+    subscribers = {str(chat_id): list(bot.VK_GROUPS) for chat_id in users}
+    started = time.perf_counter()
+    for chat_id, group in taps:
+        current_subs = subscribers[str(chat_id)]
+        if group in current_subs:
+            current_subs.remove(group)
+        else:
+            current_subs.append(group)
+        with open('subscribers_bench.json', 'w', encoding='utf-8') as f:
+            json.dump(subscribers, f, ensure_ascii=False, indent=4)
+    return time.perf_counter() - started, 0.0
+
+async def bench_store(users, taps, flush_delay):
+    store = bot.SubscriptionStore('subscribers_bench.db', flush_delay)
+    for chat_id in users:
+        store.add_user(chat_id, bot.VK_GROUPS)
+    await store.flush()
+    started = time.perf_counter()
+    for chat_id, group in taps:
+        store.toggle(chat_id, group)
+        # Нажатия приходят из обработчиков Telegram, между ними цикл событий свободен
+        await asyncio.sleep(0)
+    toggled = time.perf_counter() - started
+    await store.flush()
+    return toggled, time.perf_counter() - started - toggled
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000, help='число подписчиков')
+    parser.add_argument('--toggles', type=int, default=500, help='число нажатий кнопок')
+    parser.add_argument('--flush-delay', type=float, default=bot.SUBSCRIBERS_FLUSH_DELAY,
+                        help='окно накопления изменений, секунды')
+    args = parser.parse_args()
+
+    users = list(range(1, args.users + 1))
+    random.seed(1)
+    taps = [(random.choice(users), random.choice(bot.VK_GROUPS)) for _ in range(args.toggles)]
+
+    results = {
+        'json (до)': bench_json(users, taps),
+        'sqlite + отложенная запись': asyncio.run(bench_store(users, taps, args.flush_delay)),
+    }
+    print(f"Подписчиков: {args.users}, нажатий: {args.toggles}")
+    print(f"{'схема':<28}{'нажатий/с':>14}{'мс на нажатие':>16}{'запись, мс':>12}")
+    for name, (elapsed, flush_time) in results.items():
+        print(f"{name:<28}{args.toggles / elapsed:>14.0f}{elapsed / args.toggles * 1000:>16.3f}"
+              f"{flush_time * 1000:>12.1f}")
+
+if __name__ == '__main__':
+    main()
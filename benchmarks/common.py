@@ -0,0 +1,23 @@
+"""
+Общая подготовка бенчмарков: импорт bot.py из корня репозитория и рабочий каталог во временной папке,
+чтобы базы и файлы бенчмарков не попадали в репозиторий.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_bot(open_storage=False):
+    """
+    Импортирует bot.py и переходит во временный каталог.
+    При open_storage=True там же открываются хранилища бота (SUBSCRIBERS, sent_posts, EVENTS).
+    """
+    sys.path.insert(0, ROOT)
+    # bot.py требует токен при импорте; бенчмарки к настоящему Telegram не обращаются
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    import bot
+    os.chdir(tempfile.mkdtemp(prefix='vk-bot-bench-'))
+    if open_storage:
+        bot.open_storage()
+    return bot
@@ -0,0 +1,54 @@
+"""
+Запись настоящих стен ВКонтакте в benchmarks/fixtures (wall_<группа>.html) для bench_parsers.py.
+Страница сохраняется такой, какой её получает загрузчик бота: DOM после загрузки в Chromium
+(--fetcher playwright, по умолчанию) или HTML ответа сервера (--fetcher http).
+
+Запуск из корня репозитория (нужен доступ к vk.com):
+    python benchmarks/record_walls.py public189834198 public215503740
+    python benchmarks/record_walls.py --fetcher http club194502663
+"""
+import argparse
+import asyncio
+import os
+
+from common import load_bot
+
+bot = load_bot()
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+async def fetch_rendered(group):
+    async with bot.BROWSER.page() as page:
+        await page.goto(f'{bot.VK_BASE_URL}/{group}', timeout=bot.PAGE_LOAD_TIMEOUT, wait_until="load")
+        return await page.content()
+
+async def record(groups, fetcher):
+    if fetcher == 'playwright':
+        await bot.BROWSER.start()
+    try:
+        for group in groups:
+            if fetcher == 'playwright':
+                html = await fetch_rendered(group)
+            else:
+                html = await bot.FETCHERS['http'].fetch_html(group)
+            _, posts = bot.parse_wall_html(html)
+            path = os.path.join(FIXTURES_DIR, f'wall_{group}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            print(f"{group}: {len(html) / 1024:.0f} КБ, постов {len(posts)} -> {os.path.relpath(path)}")
+            if not posts:
+                print(f"ВНИМАНИЕ: на стене {group} не найдено постов, проверьте селекторы или способ загрузки")
+    finally:
+        for http_fetcher in bot.FETCHERS.values():
+            await http_fetcher.close()
+        await bot.BROWSER.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('groups', nargs='+', help='короткие имена групп ВКонтакте')
+    parser.add_argument('--fetcher', choices=sorted(bot.FETCHERS), default='playwright', help='способ загрузки стены')
+    args = parser.parse_args()
+    asyncio.run(record(args.groups, args.fetcher))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,23 @@
+import argparse
 import asyncio
+import contextlib
+import functools
 import json
 import logging
-from telegram import Update, Bot, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton
+import re
+import sqlite3
+import zlib
+from telegram import Update, InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
 from playwright.async_api import async_playwright
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 import os
+import time
+import heapq
+import random
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -57,68 +70,741 @@ VK_GROUPS_NAMES = {
     "public163915584": "Моркинский детский сад №7  Сказка"
 }
 
-# Файл для хранения подписчиков (теперь в виде словаря: ключ — id пользователя, значение — список сообществ)
+# Адрес ВКонтакте, с которого загружаются стены сообществ
+VK_BASE_URL = os.getenv("VK_BASE_URL", "https://vk.com")
+
+# Способ загрузки стены по умолчанию: "playwright" (Chromium) или "http" (HTML без браузера)
+DEFAULT_FETCHER = os.getenv("VK_FETCHER", "playwright")
+
+# Способ загрузки стены для отдельных групп (переопределяет DEFAULT_FETCHER),
+# например VK_GROUP_FETCHERS="club194502663=http,moukozh=playwright"
+GROUP_FETCHERS = dict(
+    item.strip().split('=', 1) for item in os.getenv("VK_GROUP_FETCHERS", "").split(',') if '=' in item
+)
+
+# Предел одновременных HTTP-соединений с ВКонтакте
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "10"))
+
+# Адрес Bot API (например, локальный тестовый сервер); по умолчанию — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Рассылка: число воркеров и лимиты Telegram — сообщений в секунду всего и в один чат
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "30"))
+DELIVERY_CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", "1"))
+
+# Повторы при сетевых ошибках: число попыток и начальная задержка (секунды), удваивается с каждой попыткой
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_RETRY_DELAY = 2
+
+# Сколько секунд при остановке бота дорассылать уже поставленные в очередь сообщения
+DELIVERY_STOP_TIMEOUT = float(os.getenv("DELIVERY_STOP_TIMEOUT", "60"))
+
+# Сколько file_id загруженных в Telegram изображений помнить
+MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", "2000"))
+
+# Как часто писать в лог скорость рассылки и глубину очереди (секунды)
+DELIVERY_STATS_INTERVAL = 60
+
+# Границы интервала между проверками одной группы (секунды) и доля случайного разброса интервала
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "120"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "3600"))
+POLL_JITTER = 0.1
+
+# Как часто писать сводку проверок и сохранять снимок последних постов (секунды)
+MONITOR_REPORT_INTERVAL = 300
+
+# Сколько самых медленных групп показывать в сводке проверок на уровне INFO
+CRAWL_REPORT_SLOWEST = 5
+
+# Метрики: адрес HTTP-сервера (порт 0 — выключен) и файл для периодического снимка в JSON (пусто — выключен).
+# В раздельном режиме процессы получают свои порт и файл, см. metrics_target
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_DUMP_INTERVAL = 60
+
+# Количество страниц браузера, на которых группы проверяются одновременно
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "4"))
+
+# Максимальное время проверки одной группы (секунды), после которого она пропускается до следующего цикла
+GROUP_DEADLINE = float(os.getenv("GROUP_DEADLINE", "90"))
+
+# Общий предел одновременно открытых страниц браузера (мониторинг и /start вместе)
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", "6"))
+
+# После стольких загрузок страница браузера закрывается и создаётся заново
+PAGE_RECYCLE_AFTER = int(os.getenv("PAGE_RECYCLE_AFTER", "50"))
+
+# Таймаут загрузки страницы сообщества (миллисекунды)
+PAGE_LOAD_TIMEOUT = 60000
+
+# За сколько секунд изменения подписок собираются в одну запись в базу
+SUBSCRIBERS_FLUSH_DELAY = float(os.getenv("SUBSCRIBERS_FLUSH_DELAY", "1"))
+
+# Старый файл подписчиков (словарь: ключ — id пользователя, значение — список сообществ);
+# при запуске его содержимое переносится в базу
 SUBSCRIBERS_FILE = 'subscribers.json'
 
-# Файл для хранения отправленных постов
+# База SQLite бота (подписчики и отправленные посты)
+DATABASE_FILE = os.getenv("DATABASE_FILE", "bot.db")
+
+# Старый файл отправленных постов; при запуске его содержимое переносится в базу
 SENT_POSTS_FILE = 'sent_posts.json'
 
-def load_subscribers():
-    if os.path.exists(SUBSCRIBERS_FILE):
-        with open(SUBSCRIBERS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                return data
-            else:
-                logger.error("Неверный формат файла подписчиков. Ожидался словарь, а получен список.")
-                return {}  # либо можно реализовать преобразование
-    return {}
+# Посты старше стольких часов (закреплённые, история при первом запуске) не рассылаются
+POST_MAX_AGE_HOURS = float(os.getenv("POST_MAX_AGE_HOURS", "48"))
+
+# Сколько ID последних отправленных постов хранить для каждого сообщества
+SENT_POSTS_KEEP_PER_GROUP = int(os.getenv("SENT_POSTS_KEEP_PER_GROUP", "500"))
+
+# Файл со снимком последнего поста каждой группы (для рассылки новым подписчикам без повторного обхода ВК)
+LATEST_POSTS_FILE = 'latest_posts.json'
+
+# Сколько секунд снимок последнего поста считается свежим. Не меньше наибольшего промежутка между
+# проверками группы: мониторинг обновляет запись при каждой проверке, и у молчащих групп она не устаревает
+LATEST_POST_MAX_AGE = max(int(os.getenv("LATEST_POST_MAX_AGE", "1800")),
+                          POLL_MAX_INTERVAL * (1 + POLL_JITTER) + GROUP_DEADLINE)
+
+# Роль процесса: 'all' — бот, обход и рассылка в одном процессе; 'crawler', 'delivery' и 'bot' —
+# раздельный режим, процессы обмениваются событиями через таблицу events в DATABASE_FILE (см. main)
+ROLES = ('all', 'crawler', 'delivery', 'bot')
+ROLE = 'all'
+
+# Раздельный режим: как часто процесс рассылки проверяет очередь событий, секунды
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
 
-def save_subscribers(subscribers):
-    with open(SUBSCRIBERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(subscribers, f, ensure_ascii=False, indent=4)
-    logger.info(f"Сохранено {len(subscribers)} подписчиков")
+# Сколько событий забирать за раз и сколько сообщений держать в памяти процесса рассылки;
+# остальные события ждут в базе
+EVENTS_BATCH = 100
+EVENTS_MAX_BACKLOG = int(os.getenv("EVENTS_MAX_BACKLOG", "1000"))
 
-def load_sent_posts():
+# Событие удаляется из базы, только когда разосланы все его сообщения. Процесс рассылки продлевает
+# аренду взятых событий; события процесса, не продлевавшего аренду столько секунд, забираются заново
+EVENTS_LEASE = 60
+
+class Metrics:
     """
-    Загружает из файла set отправленных постов (их ID) и возвращает набор.
-    Если файл отсутствует или содержит некорректные данные, возвращается пустой set.
+    Счётчики, гистограммы и вычисляемые показатели бота.
+    Отдаются в текстовом формате Prometheus (render_prometheus) и в виде словаря для JSON (snapshot).
     """
-    if os.path.exists(SENT_POSTS_FILE):
+
+    # Границы корзин гистограмм длительностей, секунды
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._help = {}
+        self._counters = {}  # имя -> {метки: значение}
+        self._histograms = {}  # имя -> {метки: [счётчики корзин..., сумма, количество]}
+        self._gauges = {}  # имя -> функция, возвращающая текущее значение
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0] * (len(self.BUCKETS) + 2)
+        for index, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                values[index] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
         try:
-            with open(SENT_POSTS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return set(data)
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def gauge(self, name, callback):
+        self._gauges[name] = callback
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+    def render_prometheus(self):
+        lines = []
+        for name, series in self._counters.items():
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{self._labels(key)} {value}" for key, value in series.items())
+        for name, series in self._histograms.items():
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, values in series.items():
+                for bound, count in zip(self.BUCKETS, values):
+                    lines.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(key, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{self._labels(key)} {values[-2]}")
+                lines.append(f"{name}_count{self._labels(key)} {values[-1]}")
+        for name, callback in self._gauges.items():
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {callback()}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        def label_text(key):
+            return ','.join(f'{label}={value}' for label, value in key)
+
+        return {
+            'counters': {name: {label_text(key): value for key, value in series.items()}
+                         for name, series in self._counters.items()},
+            'histograms': {name: {label_text(key): {'count': values[-1], 'sum': values[-2],
+                                                    'buckets': dict(zip(map(str, self.BUCKETS), values))}
+                                  for key, values in series.items()}
+                           for name, series in self._histograms.items()},
+            'gauges': {name: callback() for name, callback in self._gauges.items()},
+        }
+
+METRICS = Metrics()
+METRICS.describe('vkbot_page_load_seconds', 'Время загрузки стены группы')
+METRICS.describe('vkbot_extract_seconds', 'Время извлечения постов из загруженной стены')
+METRICS.describe('vkbot_group_check_seconds', 'Полное время проверки группы, включая постановку в рассылку')
+METRICS.describe('vkbot_group_checks_total', 'Проверки групп по результату')
+METRICS.describe('vkbot_poll_lag_seconds', 'Опоздание начала проверки группы относительно срока в расписании')
+METRICS.describe('vkbot_posts_found_total', 'Посты, извлечённые со стен')
+METRICS.describe('vkbot_posts_new_total', 'Новые посты, поставленные в рассылку')
+METRICS.describe('vkbot_send_seconds', 'Время одного запроса отправки в Telegram')
+METRICS.describe('vkbot_messages_sent_total', 'Успешно отправленные сообщения')
+METRICS.describe('vkbot_send_failures_total', 'Ошибки отправки по типу исключения')
+METRICS.describe('vkbot_delivery_queue_depth', 'Сообщения в очереди рассылки, включая отправляемые и отложенные')
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # заголовки запроса не нужны
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else ''
+        if path == '/metrics':
+            status, content_type, body = '200 OK', 'text/plain; version=0.0.4', METRICS.render_prometheus()
+        elif path == '/metrics.json':
+            status, content_type, body = '200 OK', 'application/json', json.dumps(METRICS.snapshot(), ensure_ascii=False)
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain', 'not found\n'
+        payload = body.encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
+
+def metrics_target(role, shard):
+    """
+    Порт и файл метрик процесса. В раздельном режиме у каждого процесса свои:
+    bot — METRICS_PORT, delivery — METRICS_PORT + 1, crawler доли i — METRICS_PORT + 2 + i;
+    к имени METRICS_FILE добавляется роль ("metrics.crawler-0.json").
+    """
+    if role == 'all':
+        return METRICS_PORT, METRICS_FILE
+    offset = {'bot': 0, 'delivery': 1}.get(role, 2 + shard[0])
+    name = f"crawler-{shard[0]}" if role == 'crawler' else role
+    base, ext = os.path.splitext(METRICS_FILE)
+    return (METRICS_PORT + offset if METRICS_PORT else 0), (f"{base}.{name}{ext}" if METRICS_FILE else "")
+
+async def run_metrics(port, metrics_file):
+    """
+    Отдаёт метрики по HTTP на METRICS_HOST:port (/metrics — Prometheus, /metrics.json — JSON)
+    и/или периодически сохраняет их снимок в metrics_file. Без настроек ничего не делает.
+    """
+    server = None
+    if port:
+        try:
+            server = await asyncio.start_server(handle_metrics_request, METRICS_HOST, port)
+            logger.info(f"Метрики доступны на http://{METRICS_HOST}:{port}/metrics")
+        except OSError as e:
+            # Бот работает и без метрик, но об ошибке нужно узнать сразу, а не при остановке
+            logger.error(f"Не удалось открыть порт метрик {METRICS_HOST}:{port}: {e}")
+    try:
+        while metrics_file:
+            await asyncio.sleep(METRICS_DUMP_INTERVAL)
+            tmp_file = f"{metrics_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(dict(METRICS.snapshot(), time=time.time()), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, metrics_file)
+        if server is not None:
+            await server.serve_forever()
+    finally:
+        if server is not None:
+            server.close()
+
+class SubscriptionStore:
+    """
+    Подписки пользователей в SQLite с индексами в памяти в обе стороны:
+    пользователь -> множество сообществ и сообщество -> множество подписчиков.
+    Выбор получателей поста и переключение подписки не перебирают всех пользователей.
+
+    Изменения сразу применяются к индексам в памяти, а в базу пишутся отложенно:
+    всё, что накопилось за flush_delay секунд, записывается одной транзакцией
+    в отдельном потоке, не блокируя цикл событий. Транзакция SQLite атомарна —
+    сбой во время записи не оставляет базу в промежуточном состоянии.
+    """
+
+    def __init__(self, path, flush_delay):
+        self.flush_delay = flush_delay
+        # Соединение используется только одним потоком записи за раз (см. _flush_lock)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS subscribers (chat_id INTEGER PRIMARY KEY)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS subscriptions ('
+            'chat_id INTEGER NOT NULL, group_name TEXT NOT NULL, PRIMARY KEY (chat_id, group_name)) WITHOUT ROWID'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS subscriptions_group ON subscriptions (group_name)')
+        self._db.commit()
+        self._groups_by_user = {}
+        self._users_by_group = {}
+        for (chat_id,) in self._db.execute('SELECT chat_id FROM subscribers'):
+            self._groups_by_user[chat_id] = set()
+        for chat_id, group in self._db.execute('SELECT chat_id, group_name FROM subscriptions'):
+            self._groups_by_user.setdefault(chat_id, set()).add(group)
+            self._users_by_group.setdefault(group, set()).add(chat_id)
+        # Ещё не записанные изменения: пользователь -> True (добавлен заново) / False (удалён),
+        # (пользователь, сообщество) -> подписан ли
+        self._pending_users = {}
+        self._pending_subscriptions = {}
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+
+    def __contains__(self, chat_id):
+        return chat_id in self._groups_by_user
+
+    def __len__(self):
+        return len(self._groups_by_user)
+
+    def users(self):
+        return list(self._groups_by_user)
+
+    def groups_of(self, chat_id):
+        return self._groups_by_user.get(chat_id, set())
+
+    def subscribers_of(self, group):
+        return self._users_by_group.get(group, set())
+
+    def read_subscribers_of(self, group):
+        """Подписчики сообщества из базы, минуя индекс в памяти (по индексу subscriptions_group)."""
+        return [chat_id for (chat_id,) in
+                self._db.execute('SELECT chat_id FROM subscriptions WHERE group_name = ?', (group,))]
+
+    def refresh_user(self, chat_id):
+        """
+        Перечитывает подписки пользователя из базы: в раздельном режиме их меняют и процесс бота,
+        и процесс рассылки (удаляя заблокировавших бота). Незаписанные изменения этого процесса новее базы.
+        """
+        if (self._flush_lock.locked() or chat_id in self._pending_users
+                or any(user == chat_id for user, _ in self._pending_subscriptions)):
+            return
+        exists = self._db.execute('SELECT 1 FROM subscribers WHERE chat_id = ?', (chat_id,)).fetchone()
+        stored = {group for (group,) in
+                  self._db.execute('SELECT group_name FROM subscriptions WHERE chat_id = ?', (chat_id,))}
+        for group in self._groups_by_user.pop(chat_id, set()):
+            self._users_by_group.get(group, set()).discard(chat_id)
+        if exists:
+            self._groups_by_user[chat_id] = stored
+            for group in stored:
+                self._users_by_group.setdefault(group, set()).add(chat_id)
+
+    def add_user(self, chat_id, groups):
+        self.remove_user(chat_id)
+        groups = set(groups)
+        self._groups_by_user[chat_id] = groups
+        for group in groups:
+            self._users_by_group.setdefault(group, set()).add(chat_id)
+            self._pending_subscriptions[(chat_id, group)] = True
+        self._pending_users[chat_id] = True
+        self._changed()
+
+    def remove_user(self, chat_id):
+        groups = self._groups_by_user.pop(chat_id, None)
+        if groups is None:
+            return False
+        for group in groups:
+            self._users_by_group.get(group, set()).discard(chat_id)
+            self._pending_subscriptions.pop((chat_id, group), None)
+        self._pending_users[chat_id] = False
+        self._changed()
+        return True
+
+    def toggle(self, chat_id, group):
+        """Переключает подписку на сообщество и возвращает True, если пользователь теперь подписан."""
+        groups = self._groups_by_user[chat_id]
+        if group in groups:
+            groups.discard(group)
+            self._users_by_group.get(group, set()).discard(chat_id)
+            subscribed = False
+        else:
+            groups.add(group)
+            self._users_by_group.setdefault(group, set()).add(chat_id)
+            subscribed = True
+        self._pending_subscriptions[(chat_id, group)] = subscribed
+        self._changed()
+        return subscribed
+
+    def _changed(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (перенос при запуске) пишем сразу
+            self._write(*self._take_pending())
+            return
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.create_task(self.flush()))
+
+    def _take_pending(self):
+        users, subscriptions = self._pending_users, self._pending_subscriptions
+        self._pending_users, self._pending_subscriptions = {}, {}
+        return users, subscriptions
+
+    def _write(self, users, subscriptions):
+        if not users and not subscriptions:
+            return
+        with self._db:
+            for chat_id, exists in users.items():
+                # Удалённый или добавленный заново пользователь: старые подписки стираются,
+                # актуальные приходят в subscriptions
+                self._db.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+                if exists:
+                    self._db.execute('INSERT OR IGNORE INTO subscribers VALUES (?)', (chat_id,))
                 else:
-                    logger.error("Неверный формат файла. Ожидался список ID постов.")
-                    return set()
+                    self._db.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+            self._db.executemany('INSERT OR IGNORE INTO subscriptions VALUES (?, ?)',
+                                 [key for key, subscribed in subscriptions.items() if subscribed])
+            self._db.executemany('DELETE FROM subscriptions WHERE chat_id = ? AND group_name = ?',
+                                 [key for key, subscribed in subscriptions.items() if not subscribed])
+
+    async def flush(self):
+        """Записывает накопленные изменения в базу в отдельном потоке."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            users, subscriptions = self._take_pending()
+            if not users and not subscriptions:
+                return
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, users, subscriptions)
+            except Exception as e:
+                logger.error(f"Ошибка записи подписчиков в базу: {e}")
+                # Возвращаем изменения в очередь, более новые имеют приоритет
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_subscriptions = {**subscriptions, **self._pending_subscriptions}
+                self._changed()
+                return
+            logger.info(f"Сохранены изменения подписок: пользователей {len(users)}, подписок {len(subscriptions)}")
+
+    def migrate_from_json(self, json_file):
+        """
+        Переносит подписчиков из старого subscribers.json ({id пользователя: [сообщества]})
+        и переименовывает файл, чтобы не переносить повторно.
+        """
+        if not os.path.exists(json_file):
+            return
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка декодирования JSON в файле {json_file}, перенос пропущен")
+            return
+        if not isinstance(data, dict):
+            logger.error("Неверный формат файла подписчиков. Ожидался словарь, а получен список.")
+            return
+        for user_key, groups in data.items():
+            self.add_user(int(user_key), groups)
+        os.replace(json_file, f"{json_file}.migrated")
+        logger.info(f"Перенесено {len(data)} подписчиков из {json_file} в базу")
+
+def open_subscribers():
+    store = SubscriptionStore(DATABASE_FILE, SUBSCRIBERS_FLUSH_DELAY)
+    store.migrate_from_json(SUBSCRIBERS_FILE)
+    logger.info(f"Загружено {len(store)} подписчиков")
+    return store
+
+def split_post_id(post_id):
+    """
+    Делит ID поста вида "-189834198_3680" на владельца (сообщество) и порядковый номер поста.
+    """
+    if not isinstance(post_id, str) or not post_id:
+        raise ValueError(f"Неверный ID поста: {post_id!r}")
+    owner, _, number = post_id.rpartition('_')
+    if not owner or not number.isdigit():
+        return post_id, 0
+    return owner, int(number)
+
+class SentPostsStore:
+    """
+    ID отправленных постов в SQLite (журнал WAL): проверка — поиск по первичному ключу,
+    добавление — одна вставка без перезаписи всей истории, так что сбой не портит уже сохранённое.
+    Для каждого сообщества хранятся только keep_per_group постов с наибольшими номерами.
+    Здесь же хранятся отпечатки стен групп для быстрой проверки, появилось ли что-то новое.
+    """
+
+    def __init__(self, path, keep_per_group):
+        self.keep_per_group = keep_per_group
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS sent_posts ('
+            'post_id TEXT PRIMARY KEY, owner TEXT NOT NULL, number INTEGER NOT NULL, sent_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS sent_posts_owner ON sent_posts (owner, number)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS wall_fingerprints ('
+            'group_name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def __contains__(self, post_id):
+        return self._db.execute('SELECT 1 FROM sent_posts WHERE post_id = ?', (post_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM sent_posts').fetchone()[0]
+
+    def add(self, post_id):
+        self.add_many([post_id])
+
+    def add_many(self, post_ids):
+        now = time.time()
+        rows = [(post_id, *split_post_id(post_id), now) for post_id in post_ids]
+        with self._db:
+            self._db.executemany('INSERT OR IGNORE INTO sent_posts VALUES (?, ?, ?, ?)', rows)
+
+    def get_fingerprint(self, group):
+        """Отпечаток стены группы при последней полной проверке (ID верхних постов) или None."""
+        row = self._db.execute('SELECT fingerprint FROM wall_fingerprints WHERE group_name = ?', (group,)).fetchone()
+        return row[0] if row else None
+
+    def set_fingerprint(self, group, fingerprint):
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO wall_fingerprints VALUES (?, ?, ?)',
+                             (group, fingerprint, time.time()))
+
+    def compact(self):
+        """Удаляет старые ID сверх keep_per_group на сообщество."""
+        with self._db:
+            deleted = self._db.execute(
+                'DELETE FROM sent_posts WHERE post_id IN ('
+                ' SELECT post_id FROM ('
+                '  SELECT post_id, ROW_NUMBER() OVER (PARTITION BY owner ORDER BY number DESC) AS position'
+                '  FROM sent_posts)'
+                ' WHERE position > ?)',
+                (self.keep_per_group,),
+            ).rowcount
+        if deleted:
+            logger.info(f"Удалено {deleted} старых ID отправленных постов")
+
+    def migrate_from_json(self, json_file):
+        """
+        Переносит ID из старого файла sent_posts.json и переименовывает его, чтобы не переносить повторно.
+        """
+        if not os.path.exists(json_file):
+            return
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка декодирования JSON в файле {json_file}, перенос пропущен")
+            return
+        if not isinstance(data, list):
+            logger.error(f"Неверный формат файла {json_file}. Ожидался список ID постов.")
+            return
+        self.add_many(data)
+        os.replace(json_file, f"{json_file}.migrated")
+        logger.info(f"Перенесено {len(data)} ID отправленных постов из {json_file} в базу")
+
+def open_sent_posts():
+    store = SentPostsStore(DATABASE_FILE, SENT_POSTS_KEEP_PER_GROUP)
+    store.migrate_from_json(SENT_POSTS_FILE)
+    store.compact()
+    return store
+
+class EventQueue:
+    """
+    Очередь событий раздельного режима в общей базе SQLite: процессы обхода и бота публикуют
+    сообщения для рассылки, процесс рассылки забирает их по порядку.
+    Событие поста хранит сообщество — получатели определяются по подпискам в момент рассылки;
+    событие с явным списком получателей (последние посты новому подписчику) отправляется им.
+
+    Доставка «хотя бы один раз»: claim сдаёт события в аренду процессу рассылки, ack удаляет
+    разосланное событие. События упавшего процесса забираются снова по истечении аренды,
+    и получатели, уже получившие такой пост, получат его повторно.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, group_name TEXT, recipients TEXT, '
+            'message TEXT NOT NULL, created_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL)'
+        )
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(events)')}
+        for column, column_type in (('claimed_by', 'TEXT'), ('claimed_at', 'REAL')):
+            if column not in columns:
+                # Таблица первой версии без аренды
+                self._db.execute(f'ALTER TABLE events ADD COLUMN {column} {column_type}')
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def publish(self, message, recipients):
+        with self._db:
+            self._db.execute('INSERT INTO events (recipients, message, created_at) VALUES (?, ?, ?)',
+                             (json.dumps(list(recipients)), json.dumps(message, ensure_ascii=False), time.time()))
+
+    def publish_post(self, group, post_id, message):
+        """
+        Отмечает пост отправленным в sent_posts и публикует его одной транзакцией.
+        Возвращает False, если пост уже отмечен (например, другим процессом обхода) — тогда событие не создаётся.
+        """
+        now = time.time()
+        with self._db:
+            inserted = self._db.execute('INSERT OR IGNORE INTO sent_posts VALUES (?, ?, ?, ?)',
+                                        (post_id, *split_post_id(post_id), now)).rowcount
+            if inserted:
+                self._db.execute('INSERT INTO events (group_name, message, created_at) VALUES (?, ?, ?)',
+                                 (group, json.dumps(message, ensure_ascii=False), now))
+        return bool(inserted)
+
+    def claim(self, owner, limit, lease):
+        """
+        Берёт в аренду owner до limit старейших свободных событий (или чья аренда старше lease секунд).
+        Возвращает список (ID события, сообщество или None, сообщение, получатели или None).
+        """
+        now = time.time()
+        with self._db:
+            # Блокировка записи с начала транзакции: два процесса рассылки не заберут одно событие
+            self._db.execute('BEGIN IMMEDIATE')
+            rows = self._db.execute(
+                'SELECT id, group_name, recipients, message FROM events '
+                'WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT ?', (now - lease, limit)
+            ).fetchall()
+            self._db.executemany('UPDATE events SET claimed_by = ?, claimed_at = ? WHERE id = ?',
+                                 [(owner, now, row[0]) for row in rows])
+        return [(event_id, group, json.loads(message), json.loads(recipients) if recipients else None)
+                for event_id, group, recipients, message in rows]
+
+    def renew(self, owner):
+        """Продлевает аренду всех событий owner."""
+        with self._db:
+            self._db.execute('UPDATE events SET claimed_at = ? WHERE claimed_by = ?', (time.time(), owner))
+
+    def release(self, owner):
+        """Возвращает неразосланные события owner в очередь (при остановке процесса рассылки)."""
+        with self._db:
+            self._db.execute('UPDATE events SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?', (owner,))
+
+    def ack(self, event_id):
+        """Удаляет событие, все сообщения которого разосланы."""
+        with self._db:
+            self._db.execute('DELETE FROM events WHERE id = ?', (event_id,))
+
+def load_latest_posts():
+    """
+    Загружает снимок последних постов: словарь группа -> данные поста с отметкой fetched_at.
+    """
+    if os.path.exists(LATEST_POSTS_FILE):
+        try:
+            with open(LATEST_POSTS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+                logger.error("Неверный формат файла последних постов. Ожидался словарь.")
         except json.JSONDecodeError:
-            logger.error("Ошибка декодирования JSON в файле отправленных постов. Создаём пустой список.")
-            return set()
-    return set()
+            logger.error("Ошибка декодирования JSON в файле последних постов. Начинаем с пустого снимка.")
+    return {}
 
-def save_sent_posts(sent_posts):
+def save_latest_posts(latest_posts):
     """
-    Сохраняет набор ID отправленных постов в файл SENT_POSTS_FILE в виде списка.
+    Сохраняет снимок последних постов через временный файл, чтобы сбой во время записи не портил его.
+    Процесс обхода в раздельном режиме видит только свою долю групп, поэтому дополняет снимок на диске.
     """
-    with open(SENT_POSTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(list(sent_posts), f, ensure_ascii=False, indent=2)
+    if ROLE == 'crawler':
+        saved = load_latest_posts()
+        for group, post in latest_posts.items():
+            if post.get('fetched_at', 0) >= saved.get(group, {}).get('fetched_at', 0):
+                saved[group] = post
+        latest_posts = saved
+    tmp_file = f"{LATEST_POSTS_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(latest_posts, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, LATEST_POSTS_FILE)
 
 # Глобальные переменные
-SUBSCRIBERS = load_subscribers()
-sent_posts = load_sent_posts()
+# Хранилища открываются при запуске (open_storage в main), а не при импорте модуля
+SUBSCRIBERS = None
+sent_posts = None
+EVENTS = None
+LATEST_POSTS = {}
+# ID постов с верха стены каждой группы, увиденных при прошлых проверках (в памяти процесса)
+KNOWN_WALL_IDS = {}
+
+def open_storage():
+    """
+    Открывает базу бота в текущем каталоге (перенося старые JSON-файлы) и загружает снимок последних постов.
+    """
+    global SUBSCRIBERS, sent_posts, EVENTS
+    SUBSCRIBERS = open_subscribers()
+    sent_posts = open_sent_posts()
+    EVENTS = EventQueue(DATABASE_FILE)
+    LATEST_POSTS.update(load_latest_posts())
+
+def remember_latest_post(group, post):
+    LATEST_POSTS[group] = dict(post, fetched_at=time.time())
+
+def get_cached_latest_post(group):
+    """
+    Возвращает последний пост группы из снимка или None, если записи нет или она устарела.
+    """
+    post = LATEST_POSTS.get(group)
+    if post is None or time.time() - post.get('fetched_at', 0) > LATEST_POST_MAX_AGE:
+        return None
+    return post
+
+def format_post_message(group, post):
+    group_name = VK_GROUPS_NAMES.get(group, group)
+    return f"{group_name}\n\n{post['text']}\n\n{post['date']}"
+
+def sync_subscriber(chat_id):
+    """В раздельном режиме подписки меняют несколько процессов: перечитываем пользователя из базы."""
+    if ROLE != 'all':
+        SUBSCRIBERS.refresh_user(chat_id)
+
+def remove_subscriber(chat_id):
+    sync_subscriber(chat_id)
+    SUBSCRIBERS.remove_user(chat_id)
 
 def should_process_post(post_id):
     return post_id not in sent_posts
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    user_key = str(user_id)
-    if user_key not in SUBSCRIBERS:
+    sync_subscriber(user_id)
+    if user_id not in SUBSCRIBERS:
         # Подписываем нового пользователя на все группы по умолчанию
-        SUBSCRIBERS[user_key] = list(VK_GROUPS)
-        save_subscribers(SUBSCRIBERS)
+        SUBSCRIBERS.add_user(user_id, VK_GROUPS)
         logger.info(f"Новый подписчик: {user_id}")
         # Отправляем последний пост из каждой группы
         asyncio.create_task(send_latest_posts_to_subscriber(user_id))
@@ -132,181 +818,1014 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    user_key = str(user_id)
-    if user_key in SUBSCRIBERS:
-        del SUBSCRIBERS[user_key]
-        save_subscribers(SUBSCRIBERS)
+    sync_subscriber(user_id)
+    if SUBSCRIBERS.remove_user(user_id):
         logger.info(f"Отписался подписчик: {user_id}")
     await update.message.reply_text('Вы отписались от уведомлений.')
 
-async def monitor_vk_groups():
-    global sent_posts
-    logger.info("Начало мониторинга групп ВКонтакте")
-    while True:
+# Селекторы разметки стены ВКонтакте, общие для Playwright и HTTP-загрузчика
+POST_SELECTOR = '.post'
+# Текст поста ищется несколькими способами по порядку
+POST_TEXT_SELECTORS = (
+    '.wall_post_text',
+    '[data-testid="showmoretext-in-expanded"] .vkitShowMoreText__text--ULCyL',
+    'div.vkitShowMoreText__text--ULCyL',
+)
+POST_IMAGES_SELECTOR = 'img.attachment__link, img.vkitImageSingle__image--wgSJ5, img.vkitMediaGridImage__image--EA3Qm'
+POST_DATE_SELECTOR = '[data-testid="post_date_block_preview"]'
+
+# Закреплённый пост стоит первым независимо от даты, поэтому на нём обход стены не останавливается
+PINNED_POST_SELECTOR = '.post_fixed'
+
+# Сколько ID постов с верха стены каждой группы помнить для ранней остановки разбора
+KNOWN_WALL_IDS_LIMIT = 50
+
+# Отпечаток стены — ID стольких верхних постов; пока он не изменился, новых постов нет
+FINGERPRINT_POSTS = 5
+
+# Извлечение всех постов стены за один вызов page.evaluate вместо обращений к каждому элементу.
+# Правила отпечатка и остановки такие же, как в parse_wall_html.
+EXTRACT_WALL_JS = """
+({selectors, known, latestOnly, fingerprint, fingerprintPosts}) => {
+    const knownIds = new Set(known);
+    // Блоки без ID (реклама, заглушки) не посты: их нельзя ни отметить отправленными, ни узнать снова
+    const nodes = Array.from(document.querySelectorAll(selectors.post)).filter(post => post.getAttribute('data-post-id'));
+    const topIds = nodes.slice(0, fingerprintPosts).map(post => post.getAttribute('data-post-id'));
+    const wallFingerprint = topIds.join(',');
+    if (fingerprint && wallFingerprint === fingerprint) {
+        return {fingerprint: wallFingerprint, posts: null};
+    }
+    const posts = [];
+    for (let index = 0; index < nodes.length; index++) {
+        const post = nodes[index];
+        const postId = post.getAttribute('data-post-id');
+        if (index > 0) {
+            if (latestOnly) break;
+            if (knownIds.has(postId)) {
+                if (post.matches(selectors.pinned)) continue;
+                break;
+            }
+        }
+        let textElement = null;
+        for (const selector of selectors.text) {
+            textElement = post.querySelector(selector);
+            if (textElement) break;
+        }
+        const dateElement = post.querySelector(selectors.date);
+        posts.push({
+            post_id: postId,
+            text: textElement ? textElement.innerText : '',
+            image_urls: Array.from(post.querySelectorAll(selectors.images), img => img.getAttribute('src')),
+            date: dateElement ? dateElement.innerText : '',
+        });
+    }
+    return {fingerprint: wallFingerprint, posts: posts};
+}
+"""
+
+def _node_text(node):
+    # Аналог inner_text: переводы строк вместо <br>
+    for br in node.css('br'):
+        br.replace_with('\n')
+    return node.text().strip()
+
+def parse_wall_html(html, known_ids=(), latest_only=False, fingerprint=None):
+    """
+    Разбирает HTML стены без браузера. Возвращает пару (отпечаток стены, посты в порядке стены).
+    Если отпечаток — ID верхних FINGERPRINT_POSTS постов — совпал с переданным fingerprint,
+    стена не изменилась и вместо постов возвращается None.
+    Первый пост возвращается всегда (он нужен для снимка последнего поста); дальше разбор
+    останавливается на первом известном незакреплённом посте из known_ids — ниже только более старые.
+    При latest_only возвращается только первый пост.
+    """
+    known_ids = set(known_ids)
+    tree = LexborHTMLParser(html)
+    # Блоки без ID (реклама, заглушки) не посты: их нельзя ни отметить отправленными, ни узнать снова
+    nodes = [node for node in tree.css(POST_SELECTOR) if node.attributes.get('data-post-id')]
+    wall_fingerprint = ','.join(node.attributes['data-post-id'] for node in nodes[:FINGERPRINT_POSTS])
+    if fingerprint and wall_fingerprint == fingerprint:
+        return wall_fingerprint, None
+    posts = []
+    for index, node in enumerate(nodes):
+        post_id = node.attributes.get('data-post-id')
+        if index > 0:
+            if latest_only:
+                break
+            if post_id in known_ids:
+                if node.css_matches(PINNED_POST_SELECTOR):
+                    continue
+                break
+        text_node = None
+        for selector in POST_TEXT_SELECTORS:
+            text_node = node.css_first(selector)
+            if text_node:
+                break
+        date_node = node.css_first(POST_DATE_SELECTOR)
+        posts.append({
+            'post_id': post_id,
+            'text': _node_text(text_node) if text_node else '',
+            'image_urls': [img.attributes.get('src') for img in node.css(POST_IMAGES_SELECTOR)],
+            'date': _node_text(date_node) if date_node else '',
+        })
+    return wall_fingerprint, posts
+
+async def extract_wall_posts(page, known_ids=(), latest_only=False, fingerprint=None):
+    """
+    Извлекает посты уже загруженной стены одним вызовом page.evaluate; результат и правила как в parse_wall_html.
+    """
+    result = await page.evaluate(EXTRACT_WALL_JS, {
+        'selectors': {
+            'post': POST_SELECTOR,
+            'pinned': PINNED_POST_SELECTOR,
+            'text': list(POST_TEXT_SELECTORS),
+            'images': POST_IMAGES_SELECTOR,
+            'date': POST_DATE_SELECTOR,
+        },
+        'known': list(known_ids),
+        'latestOnly': latest_only,
+        'fingerprint': fingerprint,
+        'fingerprintPosts': FINGERPRINT_POSTS,
+    })
+    return result['fingerprint'], result['posts']
+
+class PlaywrightFetcher:
+    """
+    Загрузка стены через Chromium из общего пула BROWSER. Работает с любой разметкой, но дорого по CPU и памяти.
+    """
+    name = 'playwright'
+
+    async def fetch_posts(self, group, known_ids=(), latest_only=False, fingerprint=None):
+        async with BROWSER.page() as page:
+            with METRICS.timer('vkbot_page_load_seconds', group=group, fetcher=self.name):
+                await page.goto(f'{VK_BASE_URL}/{group}', timeout=PAGE_LOAD_TIMEOUT, wait_until="load")
+                await page.wait_for_load_state('load')
+            with METRICS.timer('vkbot_extract_seconds', fetcher=self.name):
+                return await extract_wall_posts(page, known_ids, latest_only, fingerprint)
+
+    async def close(self):
+        pass
+
+class HttpFetcher:
+    """
+    Загрузка HTML стены через общий пул HTTP-соединений и разбор без браузера.
+    Подходит для групп, стена которых отдаётся сервером без выполнения JavaScript.
+    """
+    name = 'http'
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=PAGE_LOAD_TIMEOUT / 1000,
+                follow_redirects=True,
+                headers={
+                    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                                  '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+                    'Accept-Language': 'ru-RU,ru;q=0.9',
+                },
+            )
+        return self._client
+
+    async def fetch_html(self, group):
+        """HTML стены группы в том виде, в каком его отдаёт сервер."""
+        response = await self._get_client().get(f'{VK_BASE_URL}/{group}')
+        response.raise_for_status()
+        return response.text
+
+    async def fetch_posts(self, group, known_ids=(), latest_only=False, fingerprint=None):
+        with METRICS.timer('vkbot_page_load_seconds', group=group, fetcher=self.name):
+            html = await self.fetch_html(group)
+        with METRICS.timer('vkbot_extract_seconds', fetcher=self.name):
+            return parse_wall_html(html, known_ids, latest_only, fingerprint)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class BrowserManager:
+    """
+    Один долгоживущий Chromium на весь процесс.
+    Страницы (каждая в своём контексте) выдаются из пула через `async with BROWSER.page() as page:`,
+    общее число одновременно открытых страниц ограничено max_pages для мониторинга и /start вместе.
+    Страница пересоздаётся после recycle_after использований или после ошибки,
+    упавший браузер перезапускается при следующем запросе страницы.
+    """
+
+    def __init__(self, max_pages, recycle_after):
+        self.max_pages = max_pages
+        self.recycle_after = recycle_after
+        self._playwright = None
+        self._browser = None
+        self._idle = []  # свободные страницы: список пар (страница, число использований)
+        self._slots = asyncio.Semaphore(max_pages)
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            await self._ensure_browser()
+
+    async def stop(self):
+        async with self._lock:
+            await self._close_browser()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def _ensure_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return
+        if self._browser is not None:
+            logger.warning("Браузер недоступен, перезапуск Chromium")
+            await self._close_browser()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch()
+        logger.info("Запущен Chromium")
+
+    async def _close_browser(self):
+        self._idle.clear()
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logger.warning(f"Не удалось закрыть браузер: {e}")
+            self._browser = None
+
+    async def _new_page(self):
+        # Каждой странице — собственный контекст, чтобы cookies и кэш групп не пересекались
+        context = await self._browser.new_context()
+        return await context.new_page()
+
+    async def _close_page(self, page):
+        try:
+            await page.context.close()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть страницу браузера: {e}")
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        async with self._slots:
+            async with self._lock:
+                await self._ensure_browser()
+                browser = self._browser
+                if self._idle:
+                    page, uses = self._idle.pop()
+                else:
+                    page, uses = await self._new_page(), 0
+            healthy = False
+            try:
+                yield page
+                healthy = True
+            finally:
+                uses += 1
+                if healthy and uses < self.recycle_after and browser is self._browser and browser.is_connected():
+                    self._idle.append((page, uses))
+                else:
+                    # После ошибки или прерванной навигации страница может остаться в неопределённом состоянии
+                    await self._close_page(page)
+
+BROWSER = BrowserManager(BROWSER_MAX_PAGES, PAGE_RECYCLE_AFTER)
+
+PLAYWRIGHT_FETCHER = PlaywrightFetcher()
+FETCHERS = {
+    PLAYWRIGHT_FETCHER.name: PLAYWRIGHT_FETCHER,
+    HttpFetcher.name: HttpFetcher(HTTP_MAX_CONNECTIONS),
+}
+# Опечатка в VK_FETCHER или VK_GROUP_FETCHERS иначе проявится только ошибкой каждой проверки группы
+for fetcher_name in {DEFAULT_FETCHER, *GROUP_FETCHERS.values()}:
+    if fetcher_name not in FETCHERS:
+        raise ValueError(f"Неизвестный способ загрузки стены: {fetcher_name}. Доступны: {', '.join(FETCHERS)}")
+
+async def fetch_group_posts(group, known_ids=(), latest_only=False, fingerprint=None):
+    """
+    Загружает стену выбранным для группы способом и возвращает (отпечаток стены, посты или None).
+    Если HTTP-загрузчик упал или не нашёл ни одного поста, стена загружается через Playwright.
+    """
+    fetcher = FETCHERS[GROUP_FETCHERS.get(group, DEFAULT_FETCHER)]
+    if fetcher is not PLAYWRIGHT_FETCHER:
+        try:
+            wall_fingerprint, posts = await fetcher.fetch_posts(group, known_ids, latest_only, fingerprint)
+            if wall_fingerprint:
+                return wall_fingerprint, posts
+            logger.warning(f"{fetcher.name}: посты группы {group} не найдены, загрузка через Playwright")
+        except Exception as e:
+            logger.warning(f"{fetcher.name}: ошибка загрузки группы {group} ({e}), загрузка через Playwright")
+    return await PLAYWRIGHT_FETCHER.fetch_posts(group, known_ids, latest_only, fingerprint)
+
+async def check_group(group):
+    """
+    Проверяет одно сообщество, рассылает новые посты и обновляет снимок последнего поста группы.
+    Стена с неизменившимся отпечатком дальше не разбирается.
+    Возвращает пару (изменилась ли стена, число новых постов).
+    """
+    logger.debug(f"Проверка группы: {group}")
+    known_ids = KNOWN_WALL_IDS.get(group, [])
+    fingerprint = sent_posts.get_fingerprint(group)
+    wall_fingerprint, posts = await fetch_group_posts(group, known_ids, fingerprint=fingerprint)
+    if posts is None:
+        logger.debug(f"Стена группы {group} не изменилась")
+        # Верх стены прежний: пост из снимка по-прежнему последний, продлеваем его свежесть
+        latest = LATEST_POSTS.get(group)
+        if latest is not None and latest.get('post_id') == wall_fingerprint.split(',')[0]:
+            latest['fetched_at'] = time.time()
+        return False, 0
+    logger.debug(f"Найдено {len(posts)} новых или последних постов в группе {group}")
+    METRICS.inc('vkbot_posts_found_total', len(posts), group=group)
+    if posts:
+        remember_latest_post(group, posts[0])
+    new_posts = 0
+    for post in posts:
+        post_id = post['post_id']
+        if not should_process_post(post_id):
+            logger.debug(f"Пост {post_id} уже был отправлен ранее")
+            continue
+        if not is_recent_post(post['date']):
+            # Старый пост отмечаем как отправленный, чтобы не проверять его снова
+            logger.debug(f"Пост {post_id} от {post['date']} слишком старый, пропускаем")
+            sent_posts.add(post_id)
+            continue
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Текст поста {post_id} ({len(post['text'])} символов): {post['text'][:100]}...")
+        message_text = format_post_message(group, post)
+
+        if ROLE == 'crawler':
+            # Отметка об отправке и событие для процесса рассылки пишутся одной транзакцией
+            if not EVENTS.publish_post(group, post_id, {'text': message_text, 'image_urls': post['image_urls']}):
+                logger.debug(f"Пост {post_id} уже опубликован другим процессом")
+                continue
+            logger.info(f"Новый пост {post_id} в группе {group} передан на рассылку: "
+                        f"изображений {len(post['image_urls'])}")
+        else:
+            # Отправляем уведомление только подписчикам, выбравшим данное сообщество
+            recipients = list(SUBSCRIBERS.subscribers_of(group))
+            logger.info(f"Новый пост {post_id} в группе {group}: изображений {len(post['image_urls'])}, "
+                        f"получателей {len(recipients)}")
+            if recipients:
+                await send_notification(message_text, post['image_urls'], subscribers=recipients)
+            sent_posts.add(post_id)
+        new_posts += 1
+        METRICS.inc('vkbot_posts_new_total', group=group)
+    # Верх стены и отпечаток запоминаются после рассылки: если проверка прервётся,
+    # стена будет разобрана снова целиком и неотправленные посты не потеряются
+    if posts:
+        # При следующей проверке разбор остановится на первом из этих постов
+        wall_ids = [post['post_id'] for post in posts] + known_ids
+        KNOWN_WALL_IDS[group] = list(dict.fromkeys(wall_ids))[:KNOWN_WALL_IDS_LIMIT]
+    sent_posts.set_fingerprint(group, wall_fingerprint)
+    return True, new_posts
+
+# Статусы проверки группы, означающие неудачу
+CRAWL_FAILED = ('timeout', 'error')
+
+async def crawl_group(group):
+    """
+    Проверяет группу с ограничением GROUP_DEADLINE секунд.
+    Возвращает (время проверки в секундах, статус, число новых постов);
+    статус — 'changed', 'unchanged', 'timeout' или 'error'.
+    """
+    started = time.monotonic()
+    new_posts = 0
+    try:
+        changed, new_posts = await asyncio.wait_for(check_group(group), timeout=GROUP_DEADLINE)
+        status = 'changed' if changed else 'unchanged'
+    except asyncio.TimeoutError:
+        logger.error(f"Группа {group} не проверена за {GROUP_DEADLINE} с")
+        status = 'timeout'
+    except Exception as e:
+        logger.error(f"Ошибка при проверке группы {group}: {e}")
+        status = 'error'
+    latency = time.monotonic() - started
+    METRICS.observe('vkbot_group_check_seconds', latency, group=group)
+    METRICS.inc('vkbot_group_checks_total', status=status)
+    return latency, status, new_posts
+
+def log_crawl_report(report, wall_time):
+    statuses = [status for _, status, _ in report.values()]
+    failed = sum(1 for status in statuses if status in CRAWL_FAILED)
+    new_posts = sum(new for _, _, new in report.values())
+    logger.info(
+        f"Проверки за {wall_time:.0f} с: групп {len(report)}, без изменений {statuses.count('unchanged')}, "
+        f"изменились {statuses.count('changed')}, с ошибками {failed}, новых постов {new_posts}, "
+        f"параллельность {CRAWL_CONCURRENCY}"
+    )
+    # В INFO — только самые медленные группы, полный список — в DEBUG
+    for position, (group, (latency, status, new)) in enumerate(
+            sorted(report.items(), key=lambda item: item[1][0], reverse=True)):
+        level = logging.INFO if position < CRAWL_REPORT_SLOWEST else logging.DEBUG
+        logger.log(level, f"  {group}: {latency:.1f} с ({status}, новых {new})")
+
+class PollScheduler:
+    """
+    Очередь групп с приоритетом по времени следующей проверки.
+    Интервал группы — примерно четверть ожидаемого промежутка между её постами: для часто пишущих
+    групп он близок к min_interval, для молчащих растёт до max_interval. Ожидаемый промежуток —
+    сглаженное среднее между замеченными новыми постами, но не меньше половины текущего затишья.
+    Группы с ошибками проверяются с экспоненциальной задержкой, ко всем интервалам добавляется
+    случайный разброс jitter, чтобы проверки не шли пачками.
+    """
+
+    def __init__(self, groups, min_interval, max_interval, jitter):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        now = time.monotonic()
+        self._state = {}
+        self._heap = []
+        for group in groups:
+            self._state[group] = {'last_change': now, 'mean_gap': None, 'errors': 0}
+            # Первая проверка всех групп — сразу, с небольшим разбросом
+            heapq.heappush(self._heap, (now + random.uniform(0, self.jitter * self.min_interval), group))
+
+    def pop_due(self):
+        """Извлекает группы, срок проверки которых наступил: список пар (срок, группа)."""
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    def seconds_until_next(self):
+        if not self._heap:
+            return self.max_interval
+        return max(0, self._heap[0][0] - time.monotonic())
+
+    def record(self, group, status, new_posts):
+        """Учитывает результат проверки группы и ставит её следующую проверку в очередь."""
+        now = time.monotonic()
+        state = self._state[group]
+        if status in CRAWL_FAILED:
+            state['errors'] += 1
+            interval = min(self.max_interval, self.min_interval * 2 ** state['errors'])
+        else:
+            state['errors'] = 0
+            if new_posts:
+                gap = now - state['last_change']
+                state['mean_gap'] = gap if state['mean_gap'] is None else 0.7 * state['mean_gap'] + 0.3 * gap
+                state['last_change'] = now
+            quiet = now - state['last_change']
+            expected_gap = quiet if state['mean_gap'] is None else max(state['mean_gap'], quiet / 2)
+            interval = min(self.max_interval, max(self.min_interval, expected_gap / 4))
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        heapq.heappush(self._heap, (now + interval, group))
+        return interval
+
+def shard_groups(groups, index, count):
+    """
+    Доля index из count списка групп для процесса обхода. Доля группы определяется по crc32 её имени:
+    в отличие от hash(), он одинаков во всех процессах и при каждом запуске.
+    """
+    return [group for group in groups if zlib.crc32(group.encode('utf-8')) % count == index]
+
+async def monitor_vk_groups(groups=None):
+    """
+    Проверяет группы (по умолчанию все VK_GROUPS) по мере наступления их срока в PollScheduler,
+    не более CRAWL_CONCURRENCY одновременно.
+    Раз в MONITOR_REPORT_INTERVAL секунд пишет сводку проверок и сохраняет снимок последних постов.
+    """
+    groups = VK_GROUPS if groups is None else groups
+    logger.info(f"Начало мониторинга групп ВКонтакте: {len(groups)}")
+    scheduler = PollScheduler(groups, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_JITTER)
+    crawl_slots = asyncio.Semaphore(CRAWL_CONCURRENCY)
+    wakeup = asyncio.Event()
+    running = set()
+    report = {}
+    report_started = time.monotonic()
+
+    async def poll(group, due_at):
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch()
-                page = await browser.new_page()
-
-                for group in VK_GROUPS:
-                    try:
-                        logger.info(f"Проверка группы: {group}")
-                        await page.goto(f'https://vk.com/{group}', timeout=60000, wait_until="load")
-                        await page.wait_for_load_state('load')
-
-                        posts = await page.query_selector_all('.post')
-                        logger.info(f"Найдено {len(posts)} постов в группе {group}")
-                        for post in posts:
-                            post_id = await post.get_attribute('data-post-id')
-                            logger.info(f"Обработка поста с ID: {post_id}")
-                            if should_process_post(post_id):
-                                # Пытаемся получить текст поста несколькими способами
-                                text_element = await post.query_selector('.wall_post_text')
-                                if not text_element:
-                                    text_element = await post.query_selector(
-                                        '[data-testid="showmoretext-in-expanded"] .vkitShowMoreText__text--ULCyL'
-                                    )
-                                if not text_element:
-                                    text_element = await post.query_selector('div.vkitShowMoreText__text--ULCyL')
-                                post_text = await text_element.inner_text() if text_element else ''
-                                logger.info(f"Длина текста поста: {len(post_text)}")
-                                logger.info(f"Текст поста: {post_text[:100]}...")
-
-                                # Извлекаем изображения
-                                images = await post.query_selector_all(
-                                    'img.attachment__link, img.vkitImageSingle__image--wgSJ5, img.vkitMediaGridImage__image--EA3Qm'
-                                )
-                                image_urls = [await img.get_attribute('src') for img in images]
-                                logger.info(f"Найдено {len(image_urls)} изображений")
-                                
-                                # Получаем дату публикации поста
-                                date_element = await post.query_selector('[data-testid="post_date_block_preview"]')
-                                post_date = await date_element.inner_text() if date_element else ''
-
-                                group_name = VK_GROUPS_NAMES.get(group, group)
-                                message_text = f"{group_name}\n\n{post_text}\n\n{post_date}"
-                                
-                                # Отправляем уведомление только подписчикам, выбравшим данное сообщество
-                                recipients = [int(uid) for uid, groups in SUBSCRIBERS.items() if group in groups]
-                                if recipients:
-                                    logger.info("Отправка уведомления о новом посте")
-                                    await send_notification(message_text, image_urls, subscribers=recipients)
-                                else:
-                                    logger.info(f"Нет подписчиков для группы {group}")
-                                    
-                                sent_posts.add(post_id)
-                                save_sent_posts(sent_posts)
-                            else:
-                                logger.info(f"Пост {post_id} уже был отправлен ранее")
-                    except Exception as e:
-                        logger.error(f"Ошибка при проверке группы {group}: {e}")
-
-                await browser.close()
+            async with crawl_slots:
+                # Опоздание растёт, когда проверки не успевают за расписанием (заняты все слоты)
+                METRICS.observe('vkbot_poll_lag_seconds', time.monotonic() - due_at)
+                result = await crawl_group(group)
+            # В сводке — последняя проверка группы и все её новые посты за период
+            report[group] = (result[0], result[1], result[2] + report.get(group, (0, 'unchanged', 0))[2])
+            interval = scheduler.record(group, result[1], result[2])
+            logger.debug(f"Следующая проверка группы {group} через {interval:.0f} с")
         except Exception as e:
             logger.error(f"Ошибка в мониторинге ВК: {e}")
+            scheduler.record(group, 'error', 0)
+        wakeup.set()
+
+    try:
+        while True:
+            for due_at, group in scheduler.pop_due():
+                task = asyncio.create_task(poll(group, due_at))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if time.monotonic() - report_started >= MONITOR_REPORT_INTERVAL:
+                try:
+                    log_crawl_report(report, time.monotonic() - report_started)
+                    save_latest_posts(LATEST_POSTS)
+                    sent_posts.compact()
+                except Exception as e:
+                    logger.error(f"Ошибка в мониторинге ВК: {e}")
+                report = {}
+                report_started = time.monotonic()
+
+            wakeup.clear()
+            timeout = min(scheduler.seconds_until_next(), MONITOR_REPORT_INTERVAL)
+            try:
+                # Просыпаемся к сроку ближайшей группы или раньше, если завершённая проверка поставила новую
+                await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # Проверки, начатые до остановки, не должны дописать в рассылку и базу после неё
+        tasks = list(running)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+class TokenBucket:
+    """
+    Ограничитель частоты: не более rate операций в секунду с запасом capacity.
+    Токены резервируются сразу, поэтому ожидающие обслуживаются в порядке обращения.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, cost=1):
+        """Резервирует cost токенов и возвращает, сколько секунд нужно подождать до их появления."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= cost
+        return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self, cost=1):
+        delay = self.reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class MediaCache:
+    """
+    LRU-кэш file_id изображений, уже загруженных в Telegram, по адресу изображения в ВК.
+    Повторная отправка по file_id не заставляет Telegram снова скачивать картинку из ВК.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._file_ids = OrderedDict()
+
+    def get(self, url):
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            self._file_ids.move_to_end(url)
+        return file_id
+
+    def put(self, url, file_id):
+        self._file_ids[url] = file_id
+        self._file_ids.move_to_end(url)
+        while len(self._file_ids) > self.max_size:
+            self._file_ids.popitem(last=False)
+
+    def has_all(self, urls):
+        return all(url in self._file_ids for url in urls)
+
+MEDIA_CACHE = MediaCache(MEDIA_CACHE_SIZE)
+
+async def send_message_to(bot, chat_id, message):
+    """
+    Отправляет пост в один чат: текстом, фото с подписью или альбомом.
+    Изображения, уже загруженные в Telegram, отправляются по file_id; file_id новых запоминаются.
+    """
+    image_urls = message['image_urls']
+    text = message['text']
+    media = [MEDIA_CACHE.get(url) or url for url in image_urls]
+    if image_urls:
+        if len(image_urls) == 1:
+            # Отправляем одно изображение с подписью
+            sent = [await bot.send_photo(chat_id=chat_id, photo=media[0], caption=text)]
+        else:
+            # Формируем список объектов InputMediaPhoto для отправки альбома
+            media_group = [InputMediaPhoto(media=media[0], caption=text)]
+            for item in media[1:]:
+                media_group.append(InputMediaPhoto(media=item))
+            sent = await bot.send_media_group(chat_id=chat_id, media=media_group)
+        for url, sent_message in zip(image_urls, sent):
+            if sent_message.photo:
+                # Последний размер — оригинал наибольшего разрешения
+                MEDIA_CACHE.put(url, sent_message.photo[-1].file_id)
+    else:
+        await bot.send_message(chat_id=chat_id, text=text)
+
+class DeliveryQueue:
+    """
+    Очередь рассылки: сообщения отправляются несколькими воркерами через бота приложения
+    (и его пул HTTP-соединений) с соблюдением лимитов Telegram — общего и на один чат.
+    RetryAfter приостанавливает всю отправку на указанное время и не расходует попытки сообщения,
+    сетевые ошибки повторяются с экспоненциальной задержкой, подписчики, заблокировавшие бота, удаляются.
+    Если изображений поста ещё нет в MEDIA_CACHE, пост сначала уходит одному получателю,
+    а остальные ставятся в очередь после него и получают уже загруженные file_id.
+    """
+
+    def __init__(self, workers, global_rate, chat_rate, max_attempts):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_interval = 1 / chat_rate
+        self._chat_next_send = {}  # чат -> момент, раньше которого в него нельзя отправлять
+        self._paused_until = 0
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._retry_tasks = set()
+        self._in_flight = 0
+        self._on_done = {}  # id(сообщения) -> [сколько получателей осталось, сообщение, обратный вызов]
+        self._bot = None
+        self.stats = {'enqueued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'blocked': 0}
+
+    def enqueue(self, chat_ids, message, on_done=None):
+        """
+        Ставит сообщение в очередь получателям chat_ids. on_done вызывается, когда отправка
+        всем получателям завершена (успешно или окончательной ошибкой).
+        """
+        chat_ids = list(chat_ids)
+        self.stats['enqueued'] += len(chat_ids)
+        if on_done is not None:
+            if not chat_ids:
+                on_done()
+                return
+            self._on_done[id(message)] = [len(chat_ids), message, on_done]
+        if len(chat_ids) > 1 and not MEDIA_CACHE.has_all(message['image_urls']):
+            # Первый получатель загружает изображения, остальные ждут его file_id
+            self._queue.put_nowait((chat_ids[0], message, 1, chat_ids[1:]))
+        else:
+            self._release(chat_ids, message)
+
+    def _release(self, chat_ids, message):
+        for chat_id in chat_ids:
+            self._queue.put_nowait((chat_id, message, 1, []))
+
+    def depth(self):
+        return self._queue.qsize() + self._in_flight + len(self._retry_tasks)
 
-        logger.info("Ожидание 5 минут перед следующей проверкой")
-        await asyncio.sleep(300)
+    async def start(self, bot):
+        self._bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._report_stats()))
+
+    async def stop(self, drain_timeout=0):
+        """
+        Останавливает воркеров, перед этим до drain_timeout секунд дорассылая очередь:
+        посты в ней уже отмечены отправленными и после перезапуска разосланы не будут.
+        """
+        if self._tasks and self.depth() and drain_timeout > 0:
+            logger.info(f"Дорассылка очереди перед остановкой: сообщений {self.depth()}")
+            try:
+                await asyncio.wait_for(self.join(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        remaining = self.depth()
+        for task in self._tasks + list(self._retry_tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retry_tasks, return_exceptions=True)
+        self._tasks = []
+        if remaining:
+            logger.error(f"Рассылка остановлена, не отправлено сообщений: {remaining}")
+
+    async def join(self):
+        """Ждёт, пока очередь (вместе с отложенными повторами) не опустеет."""
+        while self.depth():
+            await self._queue.join()
+            if self._retry_tasks:
+                await asyncio.wait(list(self._retry_tasks))
+
+    async def _wait_turn(self, chat_id, cost):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+        now = time.monotonic()
+        chat_slot = max(now, self._chat_next_send.get(chat_id, 0))
+        self._chat_next_send[chat_id] = chat_slot + self._chat_interval * cost
+        delay = max(chat_slot - now, self._global_bucket.reserve(cost))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._in_flight += 1
+            try:
+                await self._deliver(*job)
+            except Exception as e:
+                logger.error(f"Ошибка воркера рассылки: {e}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, message, attempt, followers):
+        # Альбом расходует лимит за каждое изображение
+        await self._wait_turn(chat_id, max(1, len(message['image_urls'])))
+        kind = 'album' if len(message['image_urls']) > 1 else 'photo' if message['image_urls'] else 'text'
+        done = True
+        try:
+            with METRICS.timer('vkbot_send_seconds', kind=kind):
+                await send_message_to(self._bot, chat_id, message)
+            self.stats['sent'] += 1
+            METRICS.inc('vkbot_messages_sent_total', kind=kind)
+            logger.debug(f"Уведомление отправлено подписчику {chat_id}")
+        except RetryAfter as e:
+            METRICS.inc('vkbot_send_failures_total', error=type(e).__name__)
+            logger.warning(f"Telegram просит подождать {e.retry_after} с (подписчик {chat_id})")
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            # Сообщение не потеряно, а отложено: попытка не расходуется, воркер дождётся конца паузы
+            self.stats['retried'] += 1
+            self._queue.put_nowait((chat_id, message, attempt, followers))
+            done = False
+        except Forbidden as e:
+            METRICS.inc('vkbot_send_failures_total', error=type(e).__name__)
+            logger.info(f"Подписчик {chat_id} заблокировал бота, удаляем: {e}")
+            self.stats['blocked'] += 1
+            try:
+                remove_subscriber(chat_id)
+            except Exception as e:
+                logger.error(f"Не удалось удалить подписчика {chat_id}: {e}")
+        except BadRequest as e:
+            METRICS.inc('vkbot_send_failures_total', error=type(e).__name__)
+            logger.error(f"Ошибка при отправке уведомления подписчику {chat_id}: {e}")
+            self.stats['failed'] += 1
+        except NetworkError as e:
+            METRICS.inc('vkbot_send_failures_total', error=type(e).__name__)
+            delay = DELIVERY_RETRY_DELAY * 2 ** (attempt - 1)
+            done = not self._retry(chat_id, message, attempt, followers, delay=delay, error=e)
+        except Exception as e:
+            METRICS.inc('vkbot_send_failures_total', error=type(e).__name__)
+            logger.error(f"Ошибка при отправке уведомления подписчику {chat_id}: {e}")
+            self.stats['failed'] += 1
+        finally:
+            if done:
+                # Отправка завершена (успешно или нет) — ожидавшие получатели рассылаются параллельно:
+                # при успехе они получат file_id из кэша, при неудаче не ждут друг друга
+                self._release(followers, message)
+                self._finished(message)
+
+    def _finished(self, message):
+        tracker = self._on_done.get(id(message))
+        if tracker is None:
+            return
+        tracker[0] -= 1
+        if tracker[0] == 0:
+            del self._on_done[id(message)]
+            tracker[2]()
+
+    def _retry(self, chat_id, message, attempt, followers, delay, error=None):
+        """Планирует повтор и возвращает True, если попытки ещё остались."""
+        if attempt >= self.max_attempts:
+            logger.error(f"Не удалось отправить уведомление подписчику {chat_id} за {attempt} попыток: {error}")
+            self.stats['failed'] += 1
+            return False
+        if error is not None:
+            logger.warning(f"Повтор отправки подписчику {chat_id} через {delay:.0f} с: {error}")
+        self.stats['retried'] += 1
+        task = asyncio.create_task(self._requeue_later((chat_id, message, attempt + 1, followers), delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+        return True
+
+    async def _requeue_later(self, job, delay):
+        await asyncio.sleep(delay)
+        self._queue.put_nowait(job)
+
+    async def _report_stats(self):
+        last_sent = self.stats['sent']
+        while True:
+            await asyncio.sleep(DELIVERY_STATS_INTERVAL)
+            sent = self.stats['sent'] - last_sent
+            last_sent = self.stats['sent']
+            # Забываем чаты, лимит которых уже восстановился
+            now = time.monotonic()
+            self._chat_next_send = {chat: t for chat, t in self._chat_next_send.items() if t > now}
+            if sent or self.depth():
+                logger.info(
+                    f"Рассылка: {sent / DELIVERY_STATS_INTERVAL:.1f} сообщ./с, в очереди {self.depth()}, "
+                    f"всего отправлено {self.stats['sent']}, повторов {self.stats['retried']}, "
+                    f"ошибок {self.stats['failed']}, заблокировали бота {self.stats['blocked']}"
+                )
+
+DELIVERY = DeliveryQueue(DELIVERY_WORKERS, DELIVERY_GLOBAL_RATE, DELIVERY_CHAT_RATE, DELIVERY_MAX_ATTEMPTS)
+METRICS.gauge('vkbot_delivery_queue_depth', DELIVERY.depth)
 
 async def send_notification(text, image_urls, subscribers=None):
-    bot = Bot(TELEGRAM_BOT_TOKEN)
+    """
+    Ставит пост в очередь рассылки указанным подписчикам (по умолчанию — всем).
+    В раздельном режиме пост публикуется в EVENTS для процесса рассылки.
+    """
     if subscribers is None:
-        recipients = [int(uid) for uid in SUBSCRIBERS.keys()]
+        recipients = SUBSCRIBERS.users()
     else:
         recipients = subscribers
-    for subscriber in recipients:
-        try:
-            if image_urls:
-                if len(image_urls) == 1:
-                    # Отправляем одно изображение с подписью
-                    await bot.send_photo(chat_id=subscriber, photo=image_urls[0], caption=text)
-                else:
-                    # Формируем список объектов InputMediaPhoto для отправки альбома
-                    media_group = []
-                    media_group.append(InputMediaPhoto(media=image_urls[0], caption=text))
-                    for url in image_urls[1:]:
-                        media_group.append(InputMediaPhoto(media=url))
-                    await bot.send_media_group(chat_id=subscriber, media=media_group)
-            else:
-                await bot.send_message(chat_id=subscriber, text=text)
-            logger.info(f"Уведомление отправлено подписчику {subscriber}")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления подписчику {subscriber}: {e}")
-
-def is_recent_post(post_time):
-    current_time = datetime.now()
-    logger.info(f"Проверка времени поста: {post_time}")
-
-    # Обработка различных форматов времени ВКонтакте
-    if 'сегодня' in post_time.lower():
-        post_time = post_time.lower().replace('сегодня в ', '')
-        post_datetime = datetime.strptime(post_time, "%H:%M").replace(year=current_time.year, month=current_time.month, day=current_time.day)
-    elif 'вчера' in post_time.lower():
-        post_time = post_time.lower().replace('вчера в ', '')
-        post_datetime = datetime.strptime(post_time, "%H:%M").replace(year=current_time.year, month=current_time.month, day=current_time.day) - timedelta(days=1)
+    message = {'text': text, 'image_urls': image_urls}
+    if ROLE == 'all':
+        DELIVERY.enqueue(recipients, message)
     else:
-        # Предполагаем формат "день месяц в час:минута"
-        post_datetime = datetime.strptime(post_time, "%d %b в %H:%M")
-        post_datetime = post_datetime.replace(year=current_time.year)
+        EVENTS.publish(message, recipients)
+
+def acknowledge_event(event_id):
+    try:
+        EVENTS.ack(event_id)
+    except sqlite3.Error as e:
+        # Событие останется в аренде и после её истечения будет разослано повторно
+        logger.error(f"Ошибка удаления разосланного события {event_id}: {e}")
+
+async def relay_events():
+    """
+    Процесс рассылки в раздельном режиме: берёт события из EVENTS в аренду и ставит их в DELIVERY;
+    событие удаляется из базы, когда его сообщения разосланы всем получателям.
+    Получатели поста берутся из базы, поэтому видны подписки, изменённые процессом бота.
+    Пока в памяти больше EVENTS_MAX_BACKLOG сообщений, новые события остаются в базе.
+    """
+    owner = f"delivery-{os.getpid()}-{time.time():.0f}"
+    logger.info(f"Начало рассылки событий из общей очереди ({owner})")
+    renewed = time.monotonic()
+    try:
+        while True:
+            events = []
+            try:
+                if time.monotonic() - renewed >= EVENTS_LEASE / 3:
+                    EVENTS.renew(owner)
+                    renewed = time.monotonic()
+                if DELIVERY.depth() < EVENTS_MAX_BACKLOG:
+                    events = EVENTS.claim(owner, EVENTS_BATCH, EVENTS_LEASE)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения очереди событий: {e}")
+            for event_id, group, message, recipients in events:
+                if recipients is None:
+                    recipients = SUBSCRIBERS.read_subscribers_of(group)
+                DELIVERY.enqueue(recipients, message, on_done=functools.partial(acknowledge_event, event_id))
+            # Полная пачка — в очереди есть ещё события, забираем их сразу
+            await asyncio.sleep(EVENTS_POLL_INTERVAL if len(events) < EVENTS_BATCH else 0)
+    finally:
+        # Неразосланные события сразу возвращаются в очередь, не дожидаясь конца аренды
+        try:
+            EVENTS.release(owner)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка возврата событий в очередь: {e}")
 
-    # Считаем пост новым, если он опубликован менее часа назад
-    is_recent = current_time - post_datetime < timedelta(hours=1)
-    logger.info(f"Пост от {post_datetime} считается {'недавним' if is_recent else 'старым'}")
-    return is_recent
+# Месяцы в датах ВКонтакте: по первым трём буквам ("мар", "марта", "мая", "сен.")
+VK_MONTHS = {
+    'янв': 1, 'фев': 2, 'мар': 3, 'апр': 4, 'мая': 5, 'май': 5, 'июн': 6,
+    'июл': 7, 'авг': 8, 'сен': 9, 'окт': 10, 'ноя': 11, 'дек': 12,
+}
+VK_NUMBER_WORDS = {'одну': 1, 'один': 1, 'две': 2, 'два': 2, 'три': 3, 'четыре': 4, 'пять': 5}
+VK_DATE_AGO_RE = re.compile(r'^(?:(\d+|[а-я]+)\s+)?(секунд|минут|час)[а-я]*\s+назад$')
+VK_DATE_DAY_RE = re.compile(r'^(сегодня|вчера|завтра)\s+в\s+(\d{1,2}):(\d{2})$')
+VK_DATE_FULL_RE = re.compile(r'^(\d{1,2})\s+([а-я]{3})[а-я]*\.?(?:\s+(\d{4}))?(?:\s+в\s+(\d{1,2}):(\d{2}))?$')
+VK_DAY_OFFSETS = {'сегодня': 0, 'вчера': -1, 'завтра': 1}
+VK_AGO_SECONDS = {'секунд': 1, 'минут': 60, 'час': 3600}
+
+@functools.lru_cache(maxsize=4096)
+def _parse_vk_date_spec(text):
+    """
+    Разбирает строку даты ВКонтакте в не зависящее от текущего времени описание:
+    ('ago', секунд), ('day', смещение в днях, часы, минуты) или ('date', год или None, месяц, день, часы, минуты).
+    Возвращает None для нераспознанных строк. Результат кэшируется по строке.
+    """
+    text = ' '.join(text.lower().replace('\xa0', ' ').split())
+    if text == 'только что':
+        return ('ago', 0)
+    match = VK_DATE_AGO_RE.match(text)
+    if match:
+        count, unit = match.groups()
+        if count is None:
+            count = 1
+        elif count.isdigit():
+            count = int(count)
+        elif count in VK_NUMBER_WORDS:
+            count = VK_NUMBER_WORDS[count]
+        else:
+            return None
+        return ('ago', count * VK_AGO_SECONDS[unit])
+    match = VK_DATE_DAY_RE.match(text)
+    if match:
+        day, hour, minute = match.groups()
+        return ('day', VK_DAY_OFFSETS[day], int(hour), int(minute))
+    match = VK_DATE_FULL_RE.match(text)
+    if match and match.group(2) in VK_MONTHS:
+        day, month, year, hour, minute = match.groups()
+        return ('date', int(year) if year else None, VK_MONTHS[month], int(day),
+                int(hour or 0), int(minute or 0))
+    return None
+
+def parse_vk_date(text, now=None):
+    """
+    Переводит дату поста ВКонтакте ("сегодня в 12:30", "5 минут назад", "12 мар в 10:15",
+    "3 сентября 2023") в datetime. Возвращает None, если строку не удалось разобрать.
+    """
+    spec = _parse_vk_date_spec(text)
+    if spec is None:
+        return None
+    now = now or datetime.now()
+    kind = spec[0]
+    if kind == 'ago':
+        return now - timedelta(seconds=spec[1])
+    # Регулярные выражения пропускают любые две цифры, так что "в 25:00" или "30 фев" отсеиваются здесь
+    try:
+        if kind == 'day':
+            _, offset, hour, minute = spec
+            return now.replace(hour=hour, minute=minute, second=0, microsecond=0) + timedelta(days=offset)
+        _, year, month, day, hour, minute = spec
+        post_datetime = datetime(year or now.year, month, day, hour, minute)
+        # Без года ВКонтакте показывает даты последних двенадцати месяцев: "28 дек" в январе — прошлый год
+        if year is None and post_datetime > now + timedelta(days=1):
+            post_datetime = post_datetime.replace(year=now.year - 1)
+    except ValueError:
+        return None
+    return post_datetime
+
+def is_recent_post(post_time, max_age=None):
+    """
+    Проверяет, опубликован ли пост не раньше max_age назад (по умолчанию POST_MAX_AGE_HOURS).
+    Если дату разобрать не удалось, пост считается свежим, чтобы не потерять его.
+    """
+    post_datetime = parse_vk_date(post_time)
+    if post_datetime is None:
+        logger.debug(f"Не удалось разобрать дату поста: {post_time!r}")
+        return True
+    return datetime.now() - post_datetime <= (max_age or timedelta(hours=POST_MAX_AGE_HOURS))
+
+# Идущие загрузки последнего поста: группа -> задача; одновременные /start ждут одну загрузку
+LATEST_POST_FETCHES = {}
+
+async def fetch_latest_post(group):
+    """
+    Загружает стену группы и возвращает её последний пост (или None), обновляя снимок.
+    Если стена этой группы уже загружается, ждёт ту же загрузку.
+    """
+    task = LATEST_POST_FETCHES.get(group)
+    if task is None:
+        task = asyncio.create_task(_fetch_latest_post(group))
+        LATEST_POST_FETCHES[group] = task
+        task.add_done_callback(lambda _: LATEST_POST_FETCHES.pop(group, None))
+    # Отмена одного ожидающего не прерывает загрузку для остальных
+    return await asyncio.shield(task)
+
+async def _fetch_latest_post(group):
+    _, posts = await fetch_group_posts(group, latest_only=True)
+    if not posts:
+        return None
+    remember_latest_post(group, posts[0])
+    return posts[0]
 
 async def send_latest_posts_to_subscriber(chat_id):
-    logger.info(f"Отправка последнего поста каждой группы новому подписчику: {chat_id}")
+    """
+    Отправляет новому подписчику последний пост каждой из его групп.
+    Посты берутся из снимка, который ведёт мониторинг; ВК загружается только для устаревших или отсутствующих записей.
+    Процесс бота в раздельном режиме ВК не загружает и берёт посты из снимка на диске, который ведут процессы обхода.
+    """
+    logger.debug(f"Отправка последнего поста каждой группы новому подписчику: {chat_id}")
+    fetched = 0
+    queued = 0
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            page = await browser.new_page()
-            for group in VK_GROUPS:
-                try:
-                    logger.info(f"Получение последнего поста из группы: {group}")
-                    await page.goto(f'https://vk.com/{group}')
-                    await page.wait_for_load_state('networkidle')
-                    posts = await page.query_selector_all('.post')
-                    if posts:
-                        latest_post = posts[0]  # Берём первый пост
-                        # Пытаемся получить текст поста несколькими способами
-                        text_element = await latest_post.query_selector('.wall_post_text')
-                        if not text_element:
-                            text_element = await latest_post.query_selector(
-                                '[data-testid="showmoretext-in-expanded"] .vkitShowMoreText__text--ULCyL'
-                            )
-                        if not text_element:
-                            text_element = await latest_post.query_selector('div.vkitShowMoreText__text--ULCyL')
-                        post_text = await text_element.inner_text() if text_element else ''
-                        
-                        images = await latest_post.query_selector_all(
-                            'img.attachment__link, img.vkitImageSingle__image--wgSJ5, img.vkitMediaGridImage__image--EA3Qm'
-                        )
-                        image_urls = [await img.get_attribute('src') for img in images]
-                        
-                        date_element = await latest_post.query_selector('[data-testid="post_date_block_preview"]')
-                        post_date = await date_element.inner_text() if date_element else ''
-
-                        group_name = VK_GROUPS_NAMES.get(group, group)
-                        message_text = f"{group_name}\n\n{post_text}\n\n{post_date}"
-                        # Отправляем уведомление, если пользователь подписан на данную группу
-                        if group in SUBSCRIBERS.get(str(chat_id), []):
-                            await send_notification(message_text, image_urls, subscribers=[chat_id])
-                            logger.info(f"Отправлено уведомление с последним постом из группы {group_name} для подписчика {chat_id}")
-                        else:
-                            logger.info(f"Пользователь {chat_id} не подписан на группу {group_name}")
-                    else:
-                        logger.warning(f"Посты не найдены в группе {group}")
-                except Exception as e:
-                    logger.error(f"Ошибка при получении поста из группы {group} для подписчика {chat_id}: {e}")
-            await browser.close()
+        if ROLE == 'bot':
+            LATEST_POSTS.update(load_latest_posts())
+        for group in VK_GROUPS:
+            group_name = VK_GROUPS_NAMES.get(group, group)
+            # Отправляем уведомление, если пользователь подписан на данную группу
+            if group not in SUBSCRIBERS.groups_of(chat_id):
+                logger.debug(f"Пользователь {chat_id} не подписан на группу {group_name}")
+                continue
+            try:
+                post = get_cached_latest_post(group)
+                if post is None and ROLE == 'bot':
+                    post = LATEST_POSTS.get(group)
+                elif post is None:
+                    logger.debug(f"Получение последнего поста из группы: {group}")
+                    post = await fetch_latest_post(group)
+                    fetched += 1
+                if post:
+                    await send_notification(format_post_message(group, post), post['image_urls'], subscribers=[chat_id])
+                    queued += 1
+                    logger.debug(f"Последний пост группы {group_name} поставлен в рассылку подписчику {chat_id}")
+                else:
+                    logger.warning(f"Посты не найдены в группе {group}")
+            except Exception as e:
+                logger.error(f"Ошибка при получении поста из группы {group} для подписчика {chat_id}: {e}")
+        if fetched:
+            save_latest_posts(LATEST_POSTS)
+        logger.info(f"Новому подписчику {chat_id} поставлено в рассылку последних постов: {queued}, "
+                    f"загружено стен ВК: {fetched}")
     except Exception as e:
         logger.error(f"Ошибка во время отправки последних постов подписчику {chat_id}: {e}")
 
 # Новая функция для показа inline-клавиатуры настройки подписок
 async def subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    user_key = str(user_id)
-    current_subs = SUBSCRIBERS.get(user_key, [])
+    sync_subscriber(user_id)
+    current_subs = SUBSCRIBERS.groups_of(user_id)
     keyboard = []
     row = []
     for group in VK_GROUPS:
@@ -326,18 +1845,13 @@ async def toggle_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    user_key = str(user_id)
     if query.data.startswith("toggle:"):
         group = query.data.split("toggle:")[1]
-        if user_key not in SUBSCRIBERS:
-            SUBSCRIBERS[user_key] = list(VK_GROUPS)
-        current_subs = SUBSCRIBERS[user_key]
-        if group in current_subs:
-            current_subs.remove(group)
-        else:
-            current_subs.append(group)
-        SUBSCRIBERS[user_key] = current_subs
-        save_subscribers(SUBSCRIBERS)
+        sync_subscriber(user_id)
+        if user_id not in SUBSCRIBERS:
+            SUBSCRIBERS.add_user(user_id, VK_GROUPS)
+        SUBSCRIBERS.toggle(user_id, group)
+        current_subs = SUBSCRIBERS.groups_of(user_id)
         # Перестраиваем клавиатуру с обновлённым состоянием кнопок
         keyboard = []
         row = []
@@ -358,40 +1872,104 @@ async def run_bot(application):
     await application.start()
     await application.updater.start_polling()
 
-async def main():
-    logger.info("Запуск бота")
+async def main(role='all', shard=(0, 1)):
+    """
+    Запускает процесс в роли role:
+    'all' — бот, обход ВК и рассылка в одном процессе (для небольших установок);
+    'crawler' — обход доли shard = (номер, всего) групп, новые посты публикуются в EVENTS;
+    'delivery' — рассылка событий из EVENTS подписчикам;
+    'bot' — только команды и кнопки; последние посты новым подписчикам тоже идут через EVENTS.
+    Процессы раздельного режима запускаются с общей DATABASE_FILE и в одном рабочем каталоге
+    (снимок последних постов), рассылка — одним процессом, обход — по одному процессу на долю.
+    Порты и файлы метрик процессов различаются, см. metrics_target.
+    """
+    global ROLE
+    ROLE = role
+    open_storage()
+    logger.info(f"Запуск бота, режим {role}" + (f", доля групп {shard[0]}/{shard[1]}" if role == 'crawler' else ""))
+
+    application = None
+    if role != 'crawler':
+        builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(TELEGRAM_API_URL)
+        application = builder.build()
+    if role in ('all', 'bot'):
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("stop", stop))
+        # Добавляем обработчик команды для настройки подписок
+        application.add_handler(CommandHandler("subscriptions", subscriptions))
+        # Обработчик для inline-кнопок (callback query) с данными, начинающимися с "toggle:"
+        application.add_handler(CallbackQueryHandler(toggle_subscription, pattern="^toggle:"))
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("stop", stop))
-    # Добавляем обработчик команды для настройки подписок
-    application.add_handler(CommandHandler("subscriptions", subscriptions))
-    # Обработчик для inline-кнопок (callback query) с данными, начинающимися с "toggle:"
-    application.add_handler(CallbackQueryHandler(toggle_subscription, pattern="^toggle:"))
+    if role in ('all', 'crawler'):
+        # Один браузер на весь процесс: им пользуются и мониторинг, и рассылка по /start
+        await BROWSER.start()
 
-    bot_task = asyncio.create_task(run_bot(application))
-    monitor_task = asyncio.create_task(monitor_vk_groups())
+    tasks = []
+    if application is not None:
+        await application.initialize()
+    if role in ('all', 'delivery'):
+        # Рассылка идёт через бота приложения и его пул соединений
+        await DELIVERY.start(application.bot)
+    if role in ('all', 'bot'):
+        tasks.append(asyncio.create_task(run_bot(application)))
+    if role in ('all', 'crawler'):
+        tasks.append(asyncio.create_task(monitor_vk_groups(shard_groups(VK_GROUPS, *shard))))
+    if role == 'delivery':
+        tasks.append(asyncio.create_task(relay_events()))
+    metrics_task = asyncio.create_task(run_metrics(*metrics_target(role, shard)))
 
-    logger.info("Бот запущен и ожидает команды")
+    logger.info("Бот запущен и ожидает команды" if role in ('all', 'bot') else "Процесс запущен")
 
     try:
-        await asyncio.gather(bot_task, monitor_task)
+        await asyncio.gather(*tasks)
     except asyncio.CancelledError:
         logger.info("Задачи отменены")
     except Exception as e:
         logger.error(f"Ошибка при выполнении задач: {e}")
     finally:
         logger.info("Завершение работы бота")
-        await application.stop()
-        monitor_task.cancel()
-        try:
-            await monitor_task
-        except asyncio.CancelledError:
-            pass
+        if application is not None and application.running:
+            await application.stop()
+        for task in tasks + [metrics_task]:
+            task.cancel()
+        for task in tasks + [metrics_task]:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Ошибка при остановке задачи: {e}")
+        await DELIVERY.stop(DELIVERY_STOP_TIMEOUT)
+        await SUBSCRIBERS.flush()
+        for fetcher in FETCHERS.values():
+            await fetcher.close()
+        await BROWSER.stop()
+
+def parse_shard(value):
+    """Доля групп в виде "номер/всего", например "0/2"."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается номер/всего, получено {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"номер доли должен быть от 0 до {count - 1}")
+    return index, count
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бот уведомлений о новых постах сообществ ВКонтакте")
+    parser.add_argument('role', nargs='?', choices=ROLES, default='all',
+                        help="роль процесса: all — всё в одном процессе (по умолчанию); "
+                             "crawler, delivery и bot — раздельный режим")
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1),
+                        help="доля групп процесса обхода: номер/всего, например 0/2 (по умолчанию 0/1)")
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.role, args.shard))
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e: